@@ -0,0 +1,158 @@
+import os
+import smtplib
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail.backends.smtp import EmailBackend
+
+
+def close_quietly(connection):
+    try:
+        connection.quit()
+    except (smtplib.SMTPException, socket.error):
+        connection.close()
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to `max_size` idle SMTP connections for each server and set of
+    credentials.  Connections idle for longer than `idle_timeout` seconds are
+    closed, and the others are checked with a `NOOP` before they are reused.
+    Connections are never shared with forked processes.
+    """
+    def __init__(self, max_size=None, idle_timeout=None):
+        if max_size is None:
+            max_size = getattr(settings, 'EMAIL_POOL_SIZE', 10)
+        if idle_timeout is None:
+            idle_timeout = getattr(settings, 'EMAIL_POOL_IDLE_TIMEOUT', 60)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.idle = {}
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    def check_pid(self):
+        if self.pid != os.getpid():
+            # The sockets belong to the parent process, so they are dropped
+            # without being closed.
+            self.idle = {}
+            self.pid = os.getpid()
+
+    def get_idle(self, key):
+        self.check_pid()
+        return self.idle.setdefault(key, [])
+
+    def is_healthy(self, connection):
+        try:
+            return connection.noop()[0] == 250
+        except (smtplib.SMTPException, socket.error):
+            return False
+
+    def acquire(self, key):
+        """
+        Returns a healthy idle connection for `key`, or `None`.
+        """
+        while True:
+            with self.lock:
+                idle = self.get_idle(key)
+                if not idle:
+                    return None
+                connection, released_at = idle.pop()
+            if time.time() - released_at <= self.idle_timeout and self.is_healthy(connection):
+                return connection
+            close_quietly(connection)
+
+    def release(self, key, connection):
+        current = time.time()
+        with self.lock:
+            idle = self.get_idle(key)
+            expired = [conn for conn, released_at in idle if current - released_at > self.idle_timeout]
+            idle[:] = [(conn, released_at) for conn, released_at in idle if current - released_at <= self.idle_timeout]
+            if len(idle) < self.max_size:
+                idle.append((connection, current))
+            else:
+                expired.append(connection)
+        for conn in expired:
+            close_quietly(conn)
+
+    def clear(self):
+        with self.lock:
+            self.check_pid()
+            connections = [conn for idle in self.idle.values() for conn, released_at in idle]
+            self.idle = {}
+        for connection in connections:
+            close_quietly(connection)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_connection_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+
+class PooledEmailBackend(EmailBackend):
+    """
+    SMTP backend which returns its connection to a process wide pool when it
+    is closed, and reuses pooled connections when it is opened, so that
+    sending doesn't pay for the TLS handshake and authentication each time.
+    A pooled connection which turns out to be disconnected is replaced once.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PooledEmailBackend, self).__init__(*args, **kwargs)
+        self.reused = False
+        self.broken = False
+
+    def get_pool_key(self):
+        return (
+            self.host, self.port, self.username, self.password, self.use_tls,
+            getattr(self, 'use_ssl', False),
+        )
+
+    def open(self):
+        if self.connection:
+            return False
+        self.connection = get_connection_pool().acquire(self.get_pool_key())
+        if self.connection is not None:
+            self.reused = True
+            return True
+        self.reused = False
+        return super(PooledEmailBackend, self).open()
+
+    def close(self):
+        if self.connection is None:
+            return
+        if self.broken:
+            self.broken = False
+            return super(PooledEmailBackend, self).close()
+        get_connection_pool().release(self.get_pool_key(), self.connection)
+        self.connection = None
+
+    def _send(self, email_message):
+        if self.connection is None:
+            return False
+        fail_silently, self.fail_silently = self.fail_silently, False
+        try:
+            try:
+                return super(PooledEmailBackend, self)._send(email_message)
+            except smtplib.SMTPServerDisconnected:
+                self.broken = True
+                if not self.reused:
+                    raise
+                self.close()
+                self.reused = False
+                super(PooledEmailBackend, self).open()
+                return super(PooledEmailBackend, self)._send(email_message)
+        except (smtplib.SMTPException, socket.error):
+            if not fail_silently:
+                raise
+            return False
+        finally:
+            self.fail_silently = fail_silently
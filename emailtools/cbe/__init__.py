@@ -1,14 +1,38 @@
-import markdown
-
-from django.template import loader
-from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail import EmailMessage, EmailMultiAlternatives, get_connection
 from django.conf import settings
-from django.utils.html import strip_tags
 from django.core.exceptions import ImproperlyConfigured
+from django.utils.decorators import classonlymethod
 from django.utils.safestring import mark_safe
 
-from .base import BaseEmail
+try:
+    from django.utils.encoding import force_text
+except ImportError:  # Django < 1.4.2
+    from django.utils.encoding import force_unicode as force_text
+
+from emailtools.suppression import get_suppression_store
+
+# Attachment, BulkSendError, SendResult and UniqueRecipients are only
+# imported to be re-exported by `emailtools`.
+from .attachments import Attachment, prepare_attachment  # NOQA
+from .base import BaseEmail, BulkSendError, SendResult  # NOQA
+from .css import inline_css
+from .instrumentation import timed
+from .lazy import LazyEmailMessage, UniqueRecipients  # NOQA
+from .loading import render_to_string
+from .localization import language_activated, localize_template_names
+from .mime import get_mime_cached_class
+from .markup import DEFAULT_MARKDOWN_EXTENSIONS, convert_markdown
 from .mixins import TemplateEmailMixin
+from .text import DEFAULT_TEXT_CONVERTER
+from .utils import import_string, render_stage, static_getter
+
+POOLED_EMAIL_BACKEND = 'emailtools.backends.smtp.PooledEmailBackend'
+
+
+def get_default_backend():
+    if getattr(settings, 'EMAIL_CONNECTION_POOL', False):
+        return POOLED_EMAIL_BACKEND
+    return None
 
 
 class BasicEmail(BaseEmail):
@@ -26,41 +50,87 @@ class BasicEmail(BaseEmail):
     attachments = None
     headers = None
     fail_silently = False
+    recipient = None
+    suppress_recipients = False
+    cache_mime = None
 
     def get_email_message_kwargs(self, **kwargs):
         kwargs = super(BasicEmail, self).get_email_message_kwargs(**kwargs)
         kwargs.update({
-            'subject': self.get_subject(),
+            # Lazy translations are evaluated while the email's language is
+            # active.
+            'subject': force_text(self.get_subject()),
             'body': self.get_body(),
             'from_email': self.get_from_email(),
-            'to': self.get_to(),
-            'cc': self.get_cc(),
-            'bcc': self.get_bcc(),
+            'to': self.filter_recipients(self.get_to()),
+            'cc': self.filter_recipients(self.get_cc()),
+            'bcc': self.filter_recipients(self.get_bcc()),
             'connection': self.get_connection(),
             'attachments': self.get_attachments(),
             'headers': self.get_headers(),
         })
         return kwargs
 
+    @static_getter('cache_mime')
+    def get_cache_mime(self):
+        if self.cache_mime is None:
+            return getattr(settings, 'EMAIL_MIME_CACHE', False)
+        return self.cache_mime
+
+    def get_email_message_class(self):
+        email_message_class = super(BasicEmail, self).get_email_message_class()
+        if self.get_cache_mime():
+            return get_mime_cached_class(email_message_class)
+        return email_message_class
+
+    def get_recipient_address(self):
+        if isinstance(self.recipient, basestring):
+            return self.recipient
+        return self.recipient.email
+
+    def get_lazy_email_message(self):
+        return LazyEmailMessage(self)
+
+    def get_suppression_store(self):
+        if not self.suppress_recipients:
+            return None
+        return get_suppression_store()
+
+    def filter_recipients(self, addresses):
+        """
+        Removes the suppressed addresses from `addresses` when
+        `suppress_recipients` is set.
+        """
+        store = self.get_suppression_store()
+        if store is None:
+            return addresses
+        return store.filter(addresses)
+
     def get_to(self):
+        if self.recipient is not None:
+            return [self.get_recipient_address()]
         if self.to is None:
             raise ImproperlyConfigured('No `to` provided')
         if isinstance(self.to, basestring):
             return [self.to]
         return self.to
 
+    @static_getter('cc')
     def get_cc(self):
         return self.cc or tuple()
 
+    @static_getter('bcc')
     def get_bcc(self):
         return self.bcc or tuple()
 
     def get_attachments(self):
-        return self.attachments or tuple()
+        return [prepare_attachment(attachment) for attachment in self.attachments or ()]
 
+    @static_getter('headers')
     def get_headers(self):
         return self.headers or {}
 
+    @static_getter('fail_silently')
     def get_fail_silently(self):
         return self.fail_silently
 
@@ -69,38 +139,101 @@ class BasicEmail(BaseEmail):
         kwargs.setdefault('fail_silently', self.get_fail_silently())
         return kwargs
 
+    @static_getter('from_email')
     def get_from_email(self):
         if self.from_email is None:
             return settings.DEFAULT_FROM_EMAIL
         return self.from_email
 
+    @static_getter('subject')
     def get_subject(self):
         if self.subject is None:
             raise ImproperlyConfigured('No `subject` provided')
         return self.subject
 
+    @static_getter('body')
     def get_body(self):
         if self.body is None:
             raise ImproperlyConfigured('No `body` provided')
         return self.body
 
     def get_connection(self):
+        if self.connection is None and get_default_backend() is not None:
+            return get_connection(get_default_backend(), fail_silently=self.get_fail_silently())
         return self.connection
 
+    @classmethod
+    def get_bulk_connection(cls):
+        if cls.connection is not None:
+            return cls.connection
+        # get_fail_silently is a static getter, so it doesn't need the calling
+        # arguments of an email.
+        return get_connection(get_default_backend(), fail_silently=cls.__new__(cls).get_fail_silently())
+
+    @classonlymethod
+    def send_to_each(cls, recipients, *args, **kwargs):
+        """
+        Sends a separate message to each item of `recipients`, which may be
+        email addresses or objects with an `email` attribute.  Recipients are
+        consumed lazily, a batch at a time.  The remaining arguments are used
+        to instantiate each email.  Returns the number of messages sent.
+        """
+        def emails():
+            for recipient in recipients:
+                email = cls(*args, **kwargs)
+                email.recipient = recipient
+                yield email
+        return sum(result.sent for result in cls.iter_send_instances(emails()))
+
 
 class HTMLEmail(TemplateEmailMixin, BasicEmail):
     """
     Sends an HTML email.
     """
     email_message_class = EmailMultiAlternatives
+    inline_css = None
 
     def get_email_message(self):
-        message = super(HTMLEmail, self).get_email_message()
-        message.attach_alternative(self.get_rendered_template(), "text/html")
+        with language_activated(self.get_language()):
+            message = super(HTMLEmail, self).get_email_message()
+            message.attach_alternative(self.get_inlined_html(), "text/html")
         return message
 
+    @static_getter('inline_css')
+    def get_inline_css(self):
+        if self.inline_css is None:
+            return getattr(settings, 'EMAIL_INLINE_CSS', False)
+        return self.inline_css
+
+    def render_inline_css(self, html):
+        return inline_css(html)
+
+    def get_text_converter(self):
+        return import_string(getattr(settings, 'EMAIL_TEXT_CONVERTER', DEFAULT_TEXT_CONVERTER))
+
+    def render_text(self, html):
+        return self.get_text_converter()(html)
+
+    @render_stage
+    def get_rendered_html(self):
+        return self.get_rendered_template()
+
+    @render_stage
+    def get_inlined_html(self):
+        html = self.get_rendered_html()
+        if not self.get_inline_css():
+            return html
+        with timed(self.__class__, 'css'):
+            return self.render_inline_css(html)
+
+    @render_stage
+    def get_rendered_text(self):
+        html = self.get_rendered_html()
+        with timed(self.__class__, 'text'):
+            return self.render_text(html)
+
     def get_body(self):
-        return strip_tags(super(HTMLEmail, self).get_body())
+        return self.get_rendered_text()
 
 
 class MarkdownEmail(HTMLEmail):
@@ -109,7 +242,11 @@ class MarkdownEmail(HTMLEmail):
     """
     layout_template = None
     template_name = None
+    markdown_extensions = None
+    markdown_extension_configs = None
+    text_from_markdown = False
 
+    @static_getter('layout_template')
     def get_layout_template(self):
         if self.layout_template is None:
             if getattr(settings, 'EMAIL_LAYOUT', None) is not None:
@@ -118,15 +255,47 @@ class MarkdownEmail(HTMLEmail):
         return [self.layout_template]
 
     def get_layout_context_data(self, **kwargs):
+        kwargs.setdefault('email_fragment_key', self.get_fragment_key())
         return kwargs
 
-    def get_rendered_template(self):
-        md = super(MarkdownEmail, self).get_rendered_template()
-        return loader.render_to_string(
-            self.get_layout_template(),
-            self.get_layout_context_data(
-                content=mark_safe(
-                    markdown.markdown(md, extensions=['markdown.extensions.extra']),
-                ),
-            ),
+    @static_getter('markdown_extensions')
+    def get_markdown_extensions(self):
+        if self.markdown_extensions is None:
+            return getattr(settings, 'EMAIL_MARKDOWN_EXTENSIONS', DEFAULT_MARKDOWN_EXTENSIONS)
+        return self.markdown_extensions
+
+    @static_getter('markdown_extension_configs')
+    def get_markdown_extension_configs(self):
+        if self.markdown_extension_configs is None:
+            return getattr(settings, 'EMAIL_MARKDOWN_EXTENSION_CONFIGS', {})
+        return self.markdown_extension_configs
+
+    def render_markdown(self, md):
+        return convert_markdown(
+            md,
+            self.get_markdown_extensions(),
+            self.get_markdown_extension_configs(),
+        )
+
+    def render_layout(self, content):
+        return render_to_string(
+            localize_template_names(self.get_layout_template(), self.get_language()),
+            self.get_layout_context_data(content=mark_safe(content)),
         )
+
+    @render_stage
+    def get_rendered_markdown(self):
+        md = self.get_rendered_template()
+        with timed(self.__class__, 'markdown'):
+            return self.render_markdown(md)
+
+    def get_rendered_text(self):
+        if self.text_from_markdown:
+            return self.get_rendered_template()
+        return super(MarkdownEmail, self).get_rendered_text()
+
+    @render_stage
+    def get_rendered_html(self):
+        content = self.get_rendered_markdown()
+        with timed(self.__class__, 'layout'):
+            return self.render_layout(content)
@@ -0,0 +1,152 @@
+import base64
+import hashlib
+import mimetypes
+import os
+from email.mime.base import MIMEBase
+
+from django.conf import settings
+
+from .utils import LRUCache
+
+
+# base64 encodes 57 bytes into each 76 character line, so chunks which are
+# a multiple of 57 bytes can be encoded separately.
+CHUNK_SIZE = 57 * 1024
+DEFAULT_ATTACHMENT_MIMETYPE = 'application/octet-stream'
+
+
+class Attachment(object):
+    """
+    An attachment read from `source`, a file path or a file-like object.  The
+    filename and mimetype default to ones derived from the path or the name
+    of the file.
+    """
+    def __init__(self, source, filename=None, mimetype=None):
+        self.source = source
+        if filename is None:
+            name = source if isinstance(source, basestring) else getattr(source, 'name', None)
+            filename = os.path.basename(name) if isinstance(name, basestring) else None
+        if mimetype is None:
+            mimetype = mimetypes.guess_type(filename or '')[0] or DEFAULT_ATTACHMENT_MIMETYPE
+        self.filename = filename
+        self.mimetype = mimetype
+
+    def is_seekable(self):
+        if isinstance(self.source, basestring):
+            return True
+        try:
+            self.source.tell()
+        except (AttributeError, IOError):
+            return False
+        return hasattr(self.source, 'seek')
+
+    def read_chunks(self):
+        if isinstance(self.source, basestring):
+            with open(self.source, 'rb') as source:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                    yield chunk
+            return
+        start = self.source.tell() if self.is_seekable() else None
+        for chunk in iter(lambda: self.source.read(CHUNK_SIZE), b''):
+            yield chunk
+        if start is not None:
+            self.source.seek(start)
+
+    def get_digest(self):
+        """
+        Returns the sha1 of the content.  The digest of a path is cached until
+        the file is modified.
+        """
+        if isinstance(self.source, basestring):
+            stat = os.stat(self.source)
+            key = (self.source, stat.st_mtime, stat.st_size)
+            digest = _path_digests.get(key)
+            if digest is None:
+                digest = self.hash_content()
+                _path_digests.set(key, digest)
+            return digest
+        return self.hash_content()
+
+    def hash_content(self):
+        sha = hashlib.sha1()
+        for chunk in self.read_chunks():
+            sha.update(chunk)
+        return sha.hexdigest()
+
+    def encode(self, sha=None):
+        """
+        Returns a base64 encoded MIME part, encoding the content a chunk at a
+        time.  The content is also added to `sha`, if given.
+        """
+        encoded = []
+        for chunk in self.read_chunks():
+            if sha is not None:
+                sha.update(chunk)
+            encoded.append(base64.encodestring(chunk))
+        basetype, subtype = self.mimetype.split('/', 1)
+        part = MIMEBase(basetype, subtype)
+        part.set_payload(''.join(encoded))
+        part['Content-Transfer-Encoding'] = 'base64'
+        if self.filename:
+            filename = self.filename
+            try:
+                filename.encode('ascii')
+            except UnicodeEncodeError:
+                filename = ('utf-8', '', filename.encode('utf-8'))
+            part.add_header('Content-Disposition', 'attachment', filename=filename)
+        return part
+
+    def get_mime_part(self):
+        """
+        Returns the encoded MIME part, which is shared by every attachment
+        with the same content, filename and mimetype.
+        """
+        cache = get_attachment_cache()
+        if not self.is_seekable():
+            # The content can only be read once, so it is hashed while it is
+            # encoded.
+            sha = hashlib.sha1()
+            part = self.encode(sha)
+            key = (sha.hexdigest(), self.filename, self.mimetype)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+            cache.set(key, part)
+            return part
+        key = (self.get_digest(), self.filename, self.mimetype)
+        part = cache.get(key)
+        if part is None:
+            part = self.encode()
+            cache.set(key, part)
+        return part
+
+
+_attachment_cache = None
+_path_digests = LRUCache(256)
+
+
+def get_attachment_cache():
+    global _attachment_cache
+    if _attachment_cache is None:
+        _attachment_cache = LRUCache(getattr(settings, 'EMAIL_ATTACHMENT_CACHE_SIZE', 32))
+    return _attachment_cache
+
+
+def clear_attachment_cache():
+    get_attachment_cache().clear()
+    _path_digests.clear()
+
+
+def prepare_attachment(attachment):
+    """
+    Converts a path, file-like object or `Attachment` into a MIME part.
+    MIME parts and `(filename, content, mimetype)` tuples are returned
+    unchanged.
+    """
+    if isinstance(attachment, basestring) or hasattr(attachment, 'read'):
+        attachment = Attachment(attachment)
+    if isinstance(attachment, Attachment):
+        if attachment.mimetype.startswith('message/'):
+            return (attachment.filename, b''.join(attachment.read_chunks()), attachment.mimetype)
+        return attachment.get_mime_part()
+    return attachment
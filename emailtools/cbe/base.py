@@ -1,8 +1,97 @@
+from collections import namedtuple
 from functools import update_wrapper
 
+from django.core import mail
 from django.utils.decorators import classonlymethod
 from django.core.exceptions import ImproperlyConfigured
 
+from .dryrun import render_many
+from .executor import get_default_executor
+from .instrumentation import instrument_message, timed
+from .localization import group_by_language, language_activated
+from .parallel import send_parallel
+from .throttle import get_default_throttle
+from .utils import LRUCache, chunked, compile_email_class, split_call_args, static_getter
+
+
+class SendResult(namedtuple('SendResult', ['recipients', 'sent'])):
+    """
+    The recipients of a message of a bulk send and whether it was sent.
+    `error` is the exception which stopped it from being sent, if any.
+    """
+    def __new__(cls, recipients, sent, error=None):
+        result = super(SendResult, cls).__new__(cls, recipients, sent)
+        result.error = error
+        return result
+
+    def __getnewargs__(self):
+        return tuple(self) + (self.error,)
+
+
+class BulkSendError(Exception):
+    """
+    Raised once a bulk send has finished if any of its messages failed with
+    an error.  `failed` holds the `SendResult` of each of those messages and
+    `results`, when known, the results of every message.
+    """
+    def __init__(self, failed, results=None):
+        super(BulkSendError, self).__init__(
+            '{0} messages failed to send, the first with: {1!r}'.format(len(failed), failed[0].error)
+        )
+        self.failed = failed
+        self.results = results
+
+
+def check_results(results):
+    failed = [result for result in results if result.error is not None]
+    if failed:
+        raise BulkSendError(failed, results)
+
+
+_callable_classes = LRUCache(256)
+
+
+def send_message(connection, message, email_class):
+    """
+    Sends `message` over `connection`, within the rate limits of the throttle
+    of `email_class`.
+    """
+    throttle = email_class.get_throttle()
+    with timed(email_class, 'send'):
+        if throttle is None:
+            return connection.send_messages([message])
+        return throttle.send(connection, message, email_class)
+
+
+def send_each(connection, messages, email_class):
+    """
+    Sends `messages` over an open `connection` and returns a `SendResult` for
+    each message.  A message which fails doesn't stop the others from being
+    sent, its error is kept in its result instead.
+    """
+    results = []
+    for message in messages:
+        try:
+            sent = send_message(connection, message, email_class)
+        except Exception as error:
+            results.append(SendResult(message.recipients(), False, error))
+        else:
+            results.append(SendResult(message.recipients(), bool(sent)))
+    return results
+
+
+def send_batch(connection, messages, email_class):
+    """
+    Like `send_each`, but opens `connection` for the batch and closes it
+    again afterwards.
+    """
+    opened = connection.open()
+    try:
+        return send_each(connection, messages, email_class)
+    finally:
+        if opened:
+            connection.close()
+
 
 class BaseEmail(object):
     """
@@ -10,6 +99,11 @@ class BaseEmail(object):
     structure for constructing an email message and sending it, along with the
     `as_callable` method logic.
     """
+    bulk_batch_size = 100
+    message_filters = ()
+    spec = None
+    language = None
+
     @property
     def email_message_class(self):
         raise ImproperlyConfigured('No `email_message_class` provided')
@@ -25,21 +119,170 @@ class BaseEmail(object):
     def get_email_message_class(self):
         return self.email_message_class
 
+    @static_getter('language')
+    def get_language(self):
+        """
+        Returns the language the message is built in, or `None` for the
+        active language.
+        """
+        return self.language
+
     def get_email_message(self):
-        return self.get_email_message_class()(**self.get_email_message_kwargs())
+        with language_activated(self.get_language()):
+            with timed(self.__class__, 'kwargs'):
+                kwargs = self.get_email_message_kwargs()
+            return instrument_message(self.__class__, self.get_email_message_class(), **kwargs)
+
+    def get_lazy_email_message(self):
+        return self.get_email_message()
 
     def get_send_kwargs(self, **kwargs):
         return kwargs
 
     def send(self):
-        self.get_email_message().send(**self.get_send_kwargs())
+        with language_activated(self.get_language()):
+            message = self.get_email_message()
+            with timed(self.__class__, 'send'):
+                message.send(**self.get_send_kwargs())
+
+    def send_async(self, executor=None):
+        if executor is None:
+            executor = get_default_executor()
+        return executor.submit(self.send)
+
+    def enqueue(self, **kwargs):
+        from emailtools.models import QueuedEmail
+
+        return QueuedEmail.objects.enqueue(self, **kwargs)
 
     def __init__(self, *args, **kwargs):
         self.args = args
         self.kwargs = kwargs
 
+    @classmethod
+    def get_bulk_batch_size(cls):
+        return cls.bulk_batch_size
+
+    @classmethod
+    def get_bulk_connection(cls):
+        return mail.get_connection()
+
+    @classmethod
+    def get_throttle(cls):
+        return get_default_throttle()
+
+    @classmethod
+    def from_bulk_item(cls, item):
+        args, kwargs = split_call_args(item)
+        return cls(*args, **kwargs)
+
+    @classmethod
+    def send_message_batch(cls, messages, connection=None):
+        """
+        Sends `messages` over `connection`, which is left open, or else over
+        a new bulk connection.
+        """
+        if connection is None:
+            return send_batch(cls.get_bulk_connection(), messages, cls)
+        return send_each(connection, messages, cls)
+
+    @classmethod
+    def prepare_batch(cls, emails):
+        pass
+
+    @classmethod
+    def filter_message(cls, message, filters=()):
+        """
+        Returns whether `message` should be sent.  Messages without
+        recipients, or rejected by any of `message_filters` or `filters`, are
+        dropped from bulk sends.
+        """
+        if not message.recipients():
+            return False
+        for message_filter in tuple(cls.message_filters) + tuple(filters):
+            if not message_filter(message):
+                return False
+        return True
+
+    @classmethod
+    def iter_send_instances(cls, emails, batch_size=None, filters=()):
+        """
+        Sends `emails` in batches and yields the `SendResult` of each.  If any
+        message failed with an error, `BulkSendError` is raised once every
+        batch has been sent.
+        """
+        if batch_size is None:
+            batch_size = cls.get_bulk_batch_size()
+        failed = []
+        for batch in chunked(emails, batch_size):
+            cls.prepare_batch(batch)
+            results = {}
+            # One connection is shared by every language of the batch, and
+            # each language is activated once for building and sending the
+            # messages of its emails.
+            connection = cls.get_bulk_connection()
+            opened = connection.open()
+            try:
+                for language, group in group_by_language(batch):
+                    with language_activated(language):
+                        messages = [email.get_lazy_email_message() for email in group]
+                        accepted = [message for message in messages if cls.filter_message(message, filters)]
+                        sent = dict(zip(map(id, accepted), cls.send_message_batch(accepted, connection)))
+                    for email, message in zip(group, messages):
+                        results[id(email)] = sent.get(id(message)) or SendResult(message.recipients(), False)
+            finally:
+                if opened:
+                    connection.close()
+            for email in batch:
+                if results[id(email)].error is not None:
+                    failed.append(results[id(email)])
+                yield results[id(email)]
+        if failed:
+            raise BulkSendError(failed)
+
+    @classmethod
+    def send_instances(cls, emails, batch_size=None, filters=()):
+        results = []
+        try:
+            for result in cls.iter_send_instances(emails, batch_size=batch_size, filters=filters):
+                results.append(result)
+        except BulkSendError as error:
+            error.results = results
+            raise
+        return results
+
     @classonlymethod
-    def as_callable(cls, **initkwargs):
+    def send_many(cls, iterable_of_args, batch_size=None, filters=()):
+        emails = (cls.from_bulk_item(item) for item in iterable_of_args)
+        return cls.send_instances(emails, batch_size=batch_size, filters=filters)
+
+    @classonlymethod
+    def send_many_parallel(cls, iterable_of_args, processes=None, chunk_size=None,
+                           ordered=True, progress=None, filters=()):
+        results = send_parallel(cls, iterable_of_args, processes, chunk_size, ordered, progress, filters)
+        check_results(results)
+        return results
+
+    @classonlymethod
+    def render_many(cls, iterable_of_args, batch_size=None, sample=0):
+        return render_many(cls, iterable_of_args, batch_size, sample)
+
+    @classonlymethod
+    def get_callable_class(cls, **initkwargs):
+        """
+        Returns a compiled subclass with `initkwargs` set as attributes.
+        Classes are reused for equal, hashable, `initkwargs`.
+        """
+        try:
+            cache_key = (cls, tuple(sorted(initkwargs.items())))
+            hash(cache_key)
+        except TypeError:
+            cache_key = None
+        if cache_key is not None:
+            EmailClass = _callable_classes.get(cache_key)
+            if EmailClass is not None:
+                return EmailClass
+
         for key in initkwargs:
             if not hasattr(cls, key):
                 raise TypeError("{0}() received an invalid keyword {1!r}. "
@@ -47,7 +290,15 @@ class BaseEmail(object):
                                 "already attributes of the "
                                 "class.".format(cls.__name__, key))
 
-        EmailClass = type("Callable{0}".format(cls.__name__), (cls,), initkwargs)
+        attrs = dict(initkwargs, callable_initkwargs=initkwargs)
+        EmailClass = compile_email_class(type("Callable{0}".format(cls.__name__), (cls,), attrs))
+        if cache_key is not None:
+            _callable_classes.set(cache_key, EmailClass)
+        return EmailClass
+
+    @classonlymethod
+    def as_callable(cls, **initkwargs):
+        EmailClass = cls.get_callable_class(**initkwargs)
 
         def callable(*args, **kwargs):
             self = EmailClass(*args, **kwargs)
@@ -55,3 +306,35 @@ class BaseEmail(object):
 
         update_wrapper(callable, EmailClass, updated=())
         return callable
+
+    @classonlymethod
+    def as_bulk_callable(cls, **initkwargs):
+        EmailClass = cls.get_callable_class(**initkwargs)
+
+        def callable(iterable_of_args, batch_size=None, filters=()):
+            return EmailClass.send_many(iterable_of_args, batch_size=batch_size, filters=filters)
+
+        update_wrapper(callable, EmailClass, updated=())
+        return callable
+
+    @classonlymethod
+    def as_async_callable(cls, executor=None, **initkwargs):
+        EmailClass = cls.get_callable_class(**initkwargs)
+
+        def callable(*args, **kwargs):
+            self = EmailClass(*args, **kwargs)
+            return self.send_async(executor)
+
+        update_wrapper(callable, EmailClass, updated=())
+        return callable
+
+    @classonlymethod
+    def as_lazy_callable(cls, **initkwargs):
+        EmailClass = cls.get_callable_class(**initkwargs)
+
+        def callable(*args, **kwargs):
+            self = EmailClass(*args, **kwargs)
+            return self.get_lazy_email_message()
+
+        update_wrapper(callable, EmailClass, updated=())
+        return callable
@@ -0,0 +1,338 @@
+import hashlib
+import re
+from HTMLParser import HTMLParser
+
+from django.conf import settings
+from django.utils.encoding import smart_str
+from django.utils.html import escape
+
+from .utils import LRUCache
+
+
+STYLE_RE = re.compile(r'<style[^>]*>(.*?)</style>', re.I | re.S)
+COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+AT_STATEMENT_RE = re.compile(r'@[\w-]+[^;{}]*;')
+SIMPLE_SELECTOR_RE = re.compile(r'^(\*|[a-zA-Z][\w-]*)?((?:[.#][\w-]+|\[[^\]]+\])*)$')
+QUALIFIER_RE = re.compile(r'([.#])([\w-]+)|\[\s*([\w-]+)\s*(?:=\s*["\']?([^"\'\]]*)["\']?\s*)?\]')
+CHILD_RE = re.compile(r'\s*>\s*')
+
+UNSTYLED_TAGS = frozenset(['base', 'head', 'link', 'meta', 'script', 'style', 'title'])
+VOID_TAGS = frozenset([
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+])
+
+
+class SimpleSelector(object):
+    __slots__ = ('tag', 'id', 'classes', 'attrs')
+
+    def __init__(self, tag, id, classes, attrs):
+        self.tag = tag
+        self.id = id
+        self.classes = classes
+        self.attrs = attrs
+
+    def matches(self, element):
+        tag, id, classes, attrs = element
+        if self.tag is not None and self.tag != tag:
+            return False
+        if self.id is not None and self.id != id:
+            return False
+        if not self.classes <= classes:
+            return False
+        for name, value in self.attrs:
+            if name not in attrs or (value is not None and attrs[name] != value):
+                return False
+        return True
+
+
+def compile_simple_selector(text):
+    match = SIMPLE_SELECTOR_RE.match(text)
+    if match is None:
+        return None
+    tag = match.group(1)
+    tag = None if tag in (None, '*') else tag.lower()
+    id = None
+    classes = set()
+    attrs = []
+    for prefix, name, attr, value in QUALIFIER_RE.findall(match.group(2)):
+        if prefix == '#':
+            id = name
+        elif prefix == '.':
+            classes.add(name)
+        else:
+            attrs.append((attr.lower(), value or None))
+    return SimpleSelector(tag, id, frozenset(classes), attrs)
+
+
+class Selector(object):
+    """
+    A compiled selector made of simple selectors joined by descendant or
+    child combinators, matched from the right against an element and the
+    stack of its ancestors.
+    """
+    __slots__ = ('parts', 'combinators', 'specificity')
+
+    def __init__(self, parts, combinators):
+        self.parts = parts
+        self.combinators = combinators
+        self.specificity = (
+            sum(1 for part in parts if part.id is not None),
+            sum(len(part.classes) + len(part.attrs) for part in parts),
+            sum(1 for part in parts if part.tag is not None),
+        )
+
+    def match_from(self, index, stack, position):
+        if not self.parts[index].matches(stack[position]):
+            return False
+        if index == len(self.parts) - 1:
+            return True
+        if self.combinators[index] == '>':
+            return position > 0 and self.match_from(index + 1, stack, position - 1)
+        for ancestor in range(position - 1, -1, -1):
+            if self.match_from(index + 1, stack, ancestor):
+                return True
+        return False
+
+    def matches(self, stack):
+        return self.match_from(0, stack, len(stack) - 1)
+
+
+def compile_selector(text):
+    """
+    Returns the compiled `Selector` for `text`, or `None` if it uses a
+    feature which can't be inlined, such as a pseudo-class.
+    """
+    tokens = CHILD_RE.sub(' > ', text.strip()).split()
+    parts = []
+    combinators = []
+    combinator = ' '
+    for token in reversed(tokens):
+        if token == '>':
+            combinator = '>'
+            continue
+        part = compile_simple_selector(token)
+        if part is None:
+            return None
+        if parts:
+            combinators.append(combinator)
+        parts.append(part)
+        combinator = ' '
+    if not parts or len(combinators) != len(parts) - 1:
+        return None
+    return Selector(parts, combinators)
+
+
+def parse_declarations(text):
+    declarations = []
+    for declaration in text.split(';'):
+        name, sep, value = declaration.partition(':')
+        name, value = name.strip().lower(), value.strip()
+        if not sep or not name or not value:
+            continue
+        important = value.lower().endswith('!important')
+        if important:
+            value = value[:-len('!important')].rstrip()
+        declarations.append((name, value, important))
+    return declarations
+
+
+def iter_rules(css):
+    """
+    Yields the `(selectors, declarations)` text of each rule of `css`,
+    skipping at-rules such as `@media` and statements such as `@import`.
+    """
+    css = AT_STATEMENT_RE.sub('', COMMENT_RE.sub('', css))
+    position = 0
+    while True:
+        start = css.find('{', position)
+        if start == -1:
+            return
+        prelude = css[position:start].strip()
+        depth, end = 1, start + 1
+        while depth and end < len(css):
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+            end += 1
+        if not prelude.startswith('@'):
+            yield prelude, css[start + 1:end - 1]
+        position = end
+
+
+class Stylesheet(object):
+    """
+    The rules of a stylesheet with compiled selectors, indexed by the id,
+    classes or tag of their rightmost simple selector.
+    """
+    def __init__(self, css):
+        self.by_id = {}
+        self.by_class = {}
+        self.by_tag = {}
+        self.universal = []
+        order = 0
+        for selectors, declarations in iter_rules(css):
+            declarations = parse_declarations(declarations)
+            if not declarations:
+                continue
+            for text in selectors.split(','):
+                selector = compile_selector(text)
+                if selector is None:
+                    continue
+                rule = (selector.specificity, order, selector, declarations)
+                order += 1
+                key = selector.parts[0]
+                if key.id is not None:
+                    self.by_id.setdefault(key.id, []).append(rule)
+                elif key.classes:
+                    self.by_class.setdefault(min(key.classes), []).append(rule)
+                elif key.tag is not None:
+                    self.by_tag.setdefault(key.tag, []).append(rule)
+                else:
+                    self.universal.append(rule)
+
+    def match(self, stack):
+        tag, id, classes, attrs = stack[-1]
+        candidates = list(self.universal)
+        candidates.extend(self.by_tag.get(tag, ()))
+        if id is not None:
+            candidates.extend(self.by_id.get(id, ()))
+        for name in classes:
+            candidates.extend(self.by_class.get(name, ()))
+        matched = [rule for rule in candidates if rule[2].matches(stack)]
+        matched.sort(key=lambda rule: rule[:2])
+        return matched
+
+
+class CSSInliner(HTMLParser):
+    """
+    Copies the html, adding the declarations of the matching rules of
+    `stylesheet` to the `style` attribute of each element.  Declarations
+    already in a `style` attribute take precedence, unless the rule's
+    declaration is `!important`.
+    """
+    def __init__(self, stylesheet):
+        HTMLParser.__init__(self)
+        self.stylesheet = stylesheet
+        self.parts = []
+        self.stack = []
+
+    def get_style(self, attrs):
+        matched = self.stylesheet.match(self.stack)
+        if not matched:
+            return None
+        styles = {}
+        order = []
+        for specificity, index, selector, declarations in matched:
+            for name, value, important in declarations:
+                if name not in styles:
+                    order.append(name)
+                if important or not styles.get(name, (None, False))[1]:
+                    styles[name] = (value, important)
+        for name, value, important in parse_declarations(attrs.get('style') or ''):
+            if name not in styles:
+                order.append(name)
+            if important or not styles.get(name, (None, False))[1]:
+                styles[name] = (value + u' !important' if important else value, important)
+        return u'; '.join(u'{0}: {1}'.format(name, styles[name][0]) for name in order)
+
+    def start(self, tag, attrs, closed):
+        attr_dict = dict(attrs)
+        element = (
+            tag,
+            attr_dict.get('id'),
+            frozenset((attr_dict.get('class') or '').split()),
+            attr_dict,
+        )
+        self.stack.append(element)
+        style = None if tag in UNSTYLED_TAGS else self.get_style(attr_dict)
+        if tag in VOID_TAGS or closed:
+            self.stack.pop()
+        if style is None:
+            self.parts.append(self.get_starttag_text())
+            return
+        attrs = [(name, value) for name, value in attrs if name != 'style']
+        attrs.append(('style', style))
+        self.parts.append(u'<{0}{1}{2}>'.format(
+            tag,
+            u''.join(
+                u' {0}'.format(name) if value is None else u' {0}="{1}"'.format(name, escape(value))
+                for name, value in attrs
+            ),
+            u' /' if closed else u'',
+        ))
+
+    def handle_starttag(self, tag, attrs):
+        self.start(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self.start(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                del self.stack[index:]
+                break
+        self.parts.append(u'</{0}>'.format(tag))
+
+    def handle_data(self, data):
+        self.parts.append(data)
+
+    def handle_entityref(self, name):
+        self.parts.append(u'&{0};'.format(name))
+
+    def handle_charref(self, name):
+        self.parts.append(u'&#{0};'.format(name))
+
+    def handle_comment(self, data):
+        self.parts.append(u'<!--{0}-->'.format(data))
+
+    def handle_decl(self, decl):
+        self.parts.append(u'<!{0}>'.format(decl))
+
+    def handle_pi(self, data):
+        self.parts.append(u'<?{0}>'.format(data))
+
+    def unknown_decl(self, data):
+        self.parts.append(u'<![{0}]>'.format(data))
+
+    def get_html(self):
+        return u''.join(self.parts)
+
+
+_stylesheet_cache = None
+
+
+def get_stylesheet_cache():
+    global _stylesheet_cache
+    if _stylesheet_cache is None:
+        _stylesheet_cache = LRUCache(getattr(settings, 'EMAIL_STYLESHEET_CACHE_SIZE', 32))
+    return _stylesheet_cache
+
+
+def get_stylesheet(css):
+    """
+    Returns the compiled `Stylesheet` for `css`, which is only compiled once.
+    """
+    cache = get_stylesheet_cache()
+    key = hashlib.sha1(smart_str(css)).hexdigest()
+    stylesheet = cache.get(key)
+    if stylesheet is None:
+        stylesheet = Stylesheet(css)
+        cache.set(key, stylesheet)
+    return stylesheet
+
+
+def inline_css(html):
+    """
+    Inlines the rules of the `<style>` elements of `html` into the `style`
+    attributes of the elements they match.
+    """
+    css = u'\n'.join(STYLE_RE.findall(html))
+    if not css.strip():
+        return html
+    inliner = CSSInliner(get_stylesheet(css))
+    inliner.feed(html)
+    inliner.close()
+    return inliner.get_html()
@@ -0,0 +1,122 @@
+import sys
+from timeit import default_timer
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from .instrumentation import TimingCollector, instrument
+from .localization import group_by_language, language_activated
+from .utils import chunked
+
+
+def get_peak_memory():
+    """
+    Returns the peak resident memory of the process in bytes, or `None` when
+    it isn't available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+class MemoryTimingCollector(TimingCollector):
+    """
+    Also attributes each growth of the peak memory of the process to the
+    phase which had just finished when it was noticed.
+    """
+    def __init__(self):
+        super(MemoryTimingCollector, self).__init__()
+        self.memory = {}
+        self.peak = get_peak_memory()
+
+    def receive(self, sender, phase, duration, **kwargs):
+        super(MemoryTimingCollector, self).receive(sender, phase, duration, **kwargs)
+        peak = get_peak_memory()
+        if peak is None:
+            return
+        key = (sender.__name__, phase)
+        with self.lock:
+            self.memory[key] = self.memory.get(key, 0) + peak - self.peak
+            self.peak = peak
+
+    def summary(self):
+        summary = super(MemoryTimingCollector, self).summary()
+        with self.lock:
+            memory = list(self.memory.items())
+        for (class_name, phase), growth in memory:
+            summary[class_name][phase]['memory'] = growth
+        return summary
+
+
+class RenderReport(object):
+    """
+    The throughput, message size and memory use of a `render_many` run.
+    """
+    def __init__(self, email_class, count, total_bytes, duration, peak_memory, phases, samples):
+        self.email_class = email_class
+        self.count = count
+        self.total_bytes = total_bytes
+        self.duration = duration
+        self.peak_memory = peak_memory
+        self.phases = phases
+        self.samples = samples
+
+    @property
+    def messages_per_second(self):
+        if not self.duration:
+            return 0.0
+        return self.count / self.duration
+
+    @property
+    def bytes_per_message(self):
+        if not self.count:
+            return 0.0
+        return float(self.total_bytes) / self.count
+
+    def as_dict(self):
+        return {
+            'email_class': self.email_class.__name__,
+            'count': self.count,
+            'total_bytes': self.total_bytes,
+            'duration': self.duration,
+            'messages_per_second': self.messages_per_second,
+            'bytes_per_message': self.bytes_per_message,
+            'peak_memory': self.peak_memory,
+            'phases': self.phases,
+        }
+
+
+def render_many(email_class, iterable_of_args, batch_size=None, sample=0):
+    """
+    Builds and serializes the message of each email in `iterable_of_args`
+    the way bulk sends do, without sending them, and returns a
+    `RenderReport`.  The first `sample` messages are kept in the report and
+    the others are discarded.
+    """
+    if batch_size is None:
+        batch_size = email_class.get_bulk_batch_size()
+    count = total_bytes = 0
+    samples = []
+    with instrument(MemoryTimingCollector()) as collector:
+        start = default_timer()
+        emails = (email_class.from_bulk_item(item) for item in iterable_of_args)
+        for batch in chunked(emails, batch_size):
+            email_class.prepare_batch(batch)
+            for language, group in group_by_language(batch):
+                with language_activated(language):
+                    for email in group:
+                        message = email.get_email_message()
+                        total_bytes += len(message.message().as_string())
+                        count += 1
+                        if len(samples) < sample:
+                            samples.append(message)
+        duration = default_timer() - start
+    return RenderReport(
+        email_class, count, total_bytes, duration, get_peak_memory(),
+        collector.summary().get(email_class.__name__, {}), samples,
+    )
@@ -0,0 +1,122 @@
+import threading
+import Queue
+
+from django.conf import settings
+from django.db import connections
+from django.utils import translation
+
+from .localization import language_activated
+
+
+class SendTimeout(Exception):
+    pass
+
+
+class SendFuture(object):
+    """
+    The eventual result of an email sent by an `EmailExecutor`.
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def done(self):
+        return self._done.is_set()
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._done.set()
+
+    def exception(self, timeout=None):
+        self._done.wait(timeout)
+        if not self._done.is_set():
+            raise SendTimeout('The email was not sent within {0} seconds'.format(timeout))
+        return self._exception
+
+    def result(self, timeout=None):
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+
+class EmailExecutor(object):
+    """
+    Sends emails from a bounded pool of worker threads, in the language that
+    was active when they were submitted.  Submitting blocks while
+    `queue_size` emails are already waiting to be sent.
+    """
+    def __init__(self, max_workers=None, queue_size=None):
+        if max_workers is None:
+            max_workers = getattr(settings, 'EMAIL_ASYNC_MAX_WORKERS', 4)
+        if queue_size is None:
+            queue_size = getattr(settings, 'EMAIL_ASYNC_QUEUE_SIZE', 100)
+        self.max_workers = max_workers
+        self.queue = Queue.Queue(queue_size)
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def submit(self, func, *args, **kwargs):
+        future = SendFuture()
+        self.start_workers()
+        self.queue.put((future, translation.get_language(), func, args, kwargs))
+        return future
+
+    def start_workers(self):
+        with self.lock:
+            while len(self.workers) < self.max_workers:
+                worker = threading.Thread(target=self.work)
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+
+    def work(self):
+        try:
+            while True:
+                item = self.queue.get()
+                try:
+                    if item is None:
+                        return
+                    future, language, func, args, kwargs = item
+                    try:
+                        with language_activated(language):
+                            future.set_result(func(*args, **kwargs))
+                    except Exception as e:
+                        future.set_exception(e)
+                finally:
+                    self.queue.task_done()
+        finally:
+            for connection in connections.all():
+                connection.close()
+
+    def wait(self):
+        """
+        Blocks until every submitted email has been sent.
+        """
+        self.queue.join()
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            self.queue.put(None)
+        if wait:
+            for worker in workers:
+                worker.join()
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor():
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = EmailExecutor()
+        return _default_executor
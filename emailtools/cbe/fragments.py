@@ -0,0 +1,56 @@
+import hashlib
+
+from django.conf import settings
+from django.utils.encoding import smart_str
+
+from .utils import LRUCache
+
+
+_fragment_cache = None
+
+
+def get_fragment_cache():
+    """
+    Returns the cache of rendered layout fragments.  This is the Django cache
+    named by `settings.EMAIL_FRAGMENT_CACHE`, or an in-process cache sized by
+    `settings.EMAIL_FRAGMENT_CACHE_SIZE` when it isn't set.
+    """
+    global _fragment_cache
+    if _fragment_cache is None:
+        alias = getattr(settings, 'EMAIL_FRAGMENT_CACHE', None)
+        if alias is None:
+            _fragment_cache = LRUCache(getattr(settings, 'EMAIL_FRAGMENT_CACHE_SIZE', 128))
+        else:
+            try:
+                from django.core.cache import caches
+                _fragment_cache = caches[alias]
+            except ImportError:  # Django < 1.7
+                from django.core.cache import get_cache
+                _fragment_cache = get_cache(alias)
+    return _fragment_cache
+
+
+def clear_fragment_cache():
+    global _fragment_cache
+    if isinstance(_fragment_cache, LRUCache):
+        _fragment_cache.clear()
+    _fragment_cache = None
+
+
+def get_fragment_cache_key(name, vary_on):
+    digest = hashlib.md5(smart_str(u':'.join(repr(value) for value in vary_on))).hexdigest()
+    return 'emailtools.fragment.{0}.{1}'.format(name, digest)
+
+
+def render_fragment(name, vary_on, render):
+    """
+    Returns the cached fragment for `name` and `vary_on`, calling `render` to
+    render and cache it when it isn't cached.
+    """
+    cache = get_fragment_cache()
+    key = get_fragment_cache_key(name, vary_on)
+    content = cache.get(key)
+    if content is None:
+        content = render()
+        cache.set(key, content)
+    return content
@@ -0,0 +1,152 @@
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.conf import settings
+from django.dispatch import Signal
+
+from .utils import extend_message_class
+
+
+email_phase_timed = Signal(providing_args=['phase', 'duration'])
+
+_local = threading.local()
+_active = 0
+_active_lock = threading.Lock()
+
+
+def is_enabled():
+    return _active > 0 or getattr(settings, 'EMAIL_INSTRUMENTATION', False)
+
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = NullTimer()
+
+
+class Timer(object):
+    """
+    Times one phase of building or sending an email and sends the
+    `email_phase_timed` signal.  The time spent in phases nested inside this
+    one is not included in its duration.
+    """
+    def __init__(self, email_class, phase):
+        self.email_class = email_class
+        self.phase = phase
+        self.nested = 0.0
+
+    def __enter__(self):
+        _local.__dict__.setdefault('stack', []).append(self)
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = default_timer() - self.start
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        email_phase_timed.send(
+            sender=self.email_class,
+            phase=self.phase,
+            duration=elapsed - self.nested,
+        )
+        return False
+
+
+def timed(email_class, phase):
+    if not is_enabled():
+        return NULL_TIMER
+    return Timer(email_class, phase)
+
+
+class TimedMessageMixin(object):
+    """
+    Times the MIME serialization of an email message as the `mime` phase of
+    its `timing_class`.  The timing class isn't pickled, so messages built in
+    another process aren't timed.
+    """
+    timing_class = None
+
+    def message(self):
+        if self.timing_class is None:
+            return super(TimedMessageMixin, self).message()
+        with Timer(self.timing_class, 'mime'):
+            return super(TimedMessageMixin, self).message()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop('timing_class', None)
+        return state
+
+
+def instrument_message(email_class, message_class, **kwargs):
+    """
+    Builds a message of `message_class` whose MIME serialization is timed
+    for `email_class` when instrumentation is enabled.
+    """
+    if not is_enabled():
+        return message_class(**kwargs)
+    message = extend_message_class(message_class, TimedMessageMixin)(**kwargs)
+    message.timing_class = email_class
+    return message
+
+
+def percentile(durations, percent):
+    ordered = sorted(durations)
+    index = max(int(round(percent / 100.0 * len(ordered))) - 1, 0)
+    return ordered[index]
+
+
+class TimingCollector(object):
+    """
+    Collects the durations sent by `email_phase_timed` and reports their
+    percentiles for each email class and phase.
+    """
+    def __init__(self):
+        self.durations = {}
+        self.lock = threading.Lock()
+
+    def receive(self, sender, phase, duration, **kwargs):
+        key = (sender.__name__, phase)
+        with self.lock:
+            self.durations.setdefault(key, []).append(duration)
+
+    def summary(self):
+        summary = {}
+        with self.lock:
+            items = list(self.durations.items())
+        for (class_name, phase), durations in items:
+            summary.setdefault(class_name, {})[phase] = {
+                'count': len(durations),
+                'total': sum(durations),
+                'p50': percentile(durations, 50),
+                'p95': percentile(durations, 95),
+                'p99': percentile(durations, 99),
+            }
+        return summary
+
+
+@contextmanager
+def instrument(collector=None):
+    """
+    Enables instrumentation within the block and yields a `TimingCollector`
+    which receives the timings.
+    """
+    global _active
+    if collector is None:
+        collector = TimingCollector()
+    email_phase_timed.connect(collector.receive)
+    with _active_lock:
+        _active += 1
+    try:
+        yield collector
+    finally:
+        with _active_lock:
+            _active -= 1
+        email_phase_timed.disconnect(collector.receive)
@@ -0,0 +1,57 @@
+class LazyEmailMessage(object):
+    """
+    Stands in for the email message of a `BasicEmail` instance.  The sender
+    and recipients are evaluated immediately, while the message itself, and
+    so its body, is only built once it is needed, such as when the backend
+    serializes it.
+    """
+    def __init__(self, email):
+        self.email = email
+        self.from_email = email.get_from_email()
+        self.to = list(email.filter_recipients(email.get_to()))
+        self.cc = list(email.filter_recipients(email.get_cc()))
+        self.bcc = list(email.filter_recipients(email.get_bcc()))
+        self._message = None
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('email', '_message'):
+            raise AttributeError(name)
+        return getattr(self.get_message(), name)
+
+    def __repr__(self):
+        state = 'rendered' if self.rendered else 'unrendered'
+        return '<LazyEmailMessage {0} to {1!r}>'.format(state, self.recipients())
+
+    @property
+    def rendered(self):
+        return self._message is not None
+
+    def get_message(self):
+        if self._message is None:
+            self._message = self.email.get_email_message()
+        return self._message
+
+    def recipients(self):
+        return self.to + self.cc + self.bcc
+
+    def message(self):
+        return self.get_message().message()
+
+    def send(self, **kwargs):
+        return self.get_message().send(**self.email.get_send_kwargs(**kwargs))
+
+
+class UniqueRecipients(object):
+    """
+    Message filter which drops messages whose recipients have all been sent
+    an earlier message.
+    """
+    def __init__(self):
+        self.seen = set()
+
+    def __call__(self, message):
+        recipients = set(address.lower() for address in message.recipients())
+        if recipients <= self.seen:
+            return False
+        self.seen.update(recipients)
+        return True
@@ -0,0 +1,62 @@
+import os
+
+from django.conf import settings
+from django.template import Context, loader
+
+from .utils import LRUCache
+
+
+_template_cache = None
+
+
+def get_template_cache():
+    """
+    Returns the cache of resolved templates, sized by
+    `settings.EMAIL_TEMPLATE_CACHE_SIZE`.
+    """
+    global _template_cache
+    if _template_cache is None:
+        _template_cache = LRUCache(getattr(settings, 'EMAIL_TEMPLATE_CACHE_SIZE', 64))
+    return _template_cache
+
+
+def clear_template_cache():
+    get_template_cache().clear()
+
+
+def get_template_mtime(template):
+    origin = getattr(template, 'origin', None)
+    name = getattr(origin, 'name', None)
+    if name is None:
+        return None
+    try:
+        return os.path.getmtime(name)
+    except (OSError, TypeError):
+        return None
+
+
+def get_template(template_names):
+    """
+    Resolves the first existing template in `template_names`, skipping the
+    template loaders if it has been resolved before.  When `settings.DEBUG`
+    is set, cached templates are reloaded once their source file changes, and
+    templates whose source file is unknown are not cached.
+    """
+    if isinstance(template_names, basestring):
+        template_names = [template_names]
+    key = tuple(template_names)
+    cache = get_template_cache()
+    cached = cache.get(key)
+    if cached is not None:
+        template, mtime = cached
+        if not settings.DEBUG:
+            return template
+        if mtime is not None and get_template_mtime(template) == mtime:
+            return template
+    template = loader.select_template(template_names)
+    cache.set(key, (template, get_template_mtime(template)))
+    return template
+
+
+def render_to_string(template_names, context):
+    return get_template(template_names).render(Context(context))
@@ -0,0 +1,66 @@
+import os
+from contextlib import contextmanager
+
+from django.utils import translation
+
+from .utils import LRUCache, OrderedDict
+
+
+_localized_names = LRUCache(256)
+
+
+@contextmanager
+def language_activated(language):
+    """
+    Activates `language` for the duration of the block.  Nothing is done when
+    `language` is `None` or already active, so nested blocks for the same
+    language don't switch translations again.
+    """
+    previous = translation.get_language()
+    if language is None or language == previous:
+        yield
+        return
+    translation.activate(language)
+    try:
+        yield
+    finally:
+        if previous is None:
+            translation.deactivate_all()
+        else:
+            translation.activate(previous)
+
+
+def group_by_language(emails):
+    """
+    Returns `(language, emails)` pairs for `emails`, in the order each
+    language first appears.
+    """
+    groups = OrderedDict()
+    for email in emails:
+        groups.setdefault(email.get_language(), []).append(email)
+    return list(groups.items())
+
+
+def localize_template_names(template_names, language):
+    """
+    Returns `template_names` with the variants for `language` before each
+    name, so `mail/welcome.html` becomes `mail/welcome.pt-br.html`,
+    `mail/welcome.pt.html` and `mail/welcome.html` for `pt-br`.
+    """
+    if isinstance(template_names, basestring):
+        template_names = [template_names]
+    if language is None:
+        return template_names
+    key = (tuple(template_names), language)
+    localized = _localized_names.get(key)
+    if localized is None:
+        codes = [language.lower()]
+        if '-' in language:
+            codes.append(language.split('-')[0].lower())
+        localized = []
+        for name in template_names:
+            root, ext = os.path.splitext(name)
+            localized.extend(u'{0}.{1}{2}'.format(root, code, ext) for code in codes)
+            localized.append(name)
+        _localized_names.set(key, localized)
+    return localized
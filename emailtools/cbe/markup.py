@@ -0,0 +1,66 @@
+import hashlib
+import threading
+
+import markdown
+
+from django.conf import settings
+from django.utils.encoding import smart_str
+
+from .utils import LRUCache
+
+
+DEFAULT_MARKDOWN_EXTENSIONS = ['markdown.extensions.extra']
+
+_converters = threading.local()
+_html_cache = None
+
+
+def get_markdown_cache():
+    """
+    Returns the cache of converted html, sized by
+    `settings.EMAIL_MARKDOWN_CACHE_SIZE`.
+    """
+    global _html_cache
+    if _html_cache is None:
+        _html_cache = LRUCache(getattr(settings, 'EMAIL_MARKDOWN_CACHE_SIZE', 128))
+    return _html_cache
+
+
+def get_converter_key(extensions, extension_configs):
+    return repr((list(extensions), sorted(extension_configs.items())))
+
+
+def get_markdown_converter(extensions, extension_configs):
+    """
+    Returns a `markdown.Markdown` instance for the given configuration.  One
+    converter is built per configuration per thread.
+    """
+    converters = _converters.__dict__.setdefault('converters', {})
+    key = get_converter_key(extensions, extension_configs)
+    if key not in converters:
+        converters[key] = markdown.Markdown(
+            extensions=list(extensions),
+            extension_configs=dict(extension_configs),
+        )
+    return converters[key]
+
+
+def convert_markdown(md, extensions, extension_configs):
+    """
+    Converts `md` to html, reusing the html from an earlier conversion of the
+    same source with the same configuration.
+    """
+    cache = get_markdown_cache()
+    cache_key = (
+        get_converter_key(extensions, extension_configs),
+        hashlib.sha1(smart_str(md)).hexdigest(),
+    )
+    html = cache.get(cache_key)
+    if html is None:
+        converter = get_markdown_converter(extensions, extension_configs)
+        try:
+            html = converter.convert(md)
+        finally:
+            converter.reset()
+        cache.set(cache_key, html)
+    return html
@@ -0,0 +1,139 @@
+import copy
+import hashlib
+from email.header import Header
+from email.mime.base import MIMEBase
+from email.utils import formatdate
+
+from django.conf import settings
+from django.core.mail.message import forbid_multi_line_headers
+from django.utils.encoding import smart_str
+
+from .utils import LRUCache, extend_message_class
+
+try:
+    from django.core.mail.message import make_msgid
+except ImportError:  # Django >= 1.8
+    from email.utils import make_msgid
+
+_mime_cache = None
+
+
+def get_mime_cache():
+    global _mime_cache
+    if _mime_cache is None:
+        _mime_cache = LRUCache(getattr(settings, 'EMAIL_MIME_CACHE_SIZE', 16))
+    return _mime_cache
+
+
+def clear_mime_cache():
+    get_mime_cache().clear()
+
+
+def is_8bit(value):
+    return isinstance(value, str) and any(ord(char) > 127 for char in value)
+
+
+def serialize_headers(msg):
+    """
+    Serializes the headers of `msg` the way `email.generator.Generator`
+    does.
+    """
+    lines = []
+    for name, value in msg.items():
+        if not isinstance(value, Header) and not is_8bit(value):
+            value = Header(value, maxlinelen=78, header_name=name)
+        if isinstance(value, Header):
+            value = value.encode()
+        lines.append('{0}: {1}\n'.format(name, value))
+    return ''.join(lines)
+
+
+class CachedMIME(object):
+    """
+    A MIME message built for one set of recipients, and its serialized body,
+    which are reused for messages with the same content.
+    """
+    def __init__(self, msg):
+        # Serializing sets the multipart boundary on the message, so it is
+        # done before the headers are copied.
+        serialized = msg.as_string()
+        self.msg = msg
+        self.body = serialized[serialized.index('\n\n') + 1:]
+
+
+class MIMECacheMixin(object):
+    """
+    Reuses the MIME tree, and its serialization, of an earlier message with
+    identical content, only replacing the `To`, `Date` and `Message-ID`
+    headers.
+    """
+    def get_mime_key(self):
+        sha = hashlib.sha1()
+
+        def update(*values):
+            for value in values:
+                # Content is hashed as is, rather than through its repr.
+                sha.update(smart_str(value) if isinstance(value, basestring) else smart_str(repr(value)))
+                sha.update(b'\0')
+
+        update(
+            self.__class__, self.subject, self.body, self.from_email, list(self.cc),
+            self.content_subtype, getattr(self, 'mixed_subtype', None), self.encoding,
+            sorted(self.extra_headers.items()),
+        )
+        for content, mimetype in getattr(self, 'alternatives', ()):
+            update(content, mimetype)
+        for attachment in self.attachments:
+            if isinstance(attachment, MIMEBase):
+                # The cached message keeps the part alive, so its id isn't
+                # reused while the key is cached.
+                update('part', id(attachment))
+            else:
+                update(*attachment)
+        return sha.hexdigest()
+
+    def get_recipient_headers(self):
+        header_names = [name.lower() for name in self.extra_headers]
+        headers = []
+        if 'to' not in header_names:
+            headers.append(('To', ', '.join(self.to)))
+        if 'date' not in header_names:
+            headers.append(('Date', formatdate()))
+        if 'message-id' not in header_names:
+            headers.append(('Message-ID', make_msgid()))
+        return headers
+
+    def message(self):
+        cache = get_mime_cache()
+        key = self.get_mime_key()
+        cached = cache.get(key)
+        if cached is None:
+            cached = CachedMIME(super(MIMECacheMixin, self).message())
+            cache.set(key, cached)
+
+        msg = copy.copy(cached.msg)
+        msg._headers = list(cached.msg._headers)
+        if isinstance(msg._payload, list):
+            msg._payload = list(msg._payload)
+        encoding = self.encoding or settings.DEFAULT_CHARSET
+        for name, value in self.get_recipient_headers():
+            msg.replace_header(name, forbid_multi_line_headers(name, value, encoding)[1])
+
+        build_string = msg.as_string
+
+        def as_string(unixfrom=False, *args, **kwargs):
+            # Django ignores `linesep` on Python 2, so only a unix from line
+            # or other arguments need the message to be serialized again.
+            if unixfrom or args or set(kwargs) - set(['linesep']):
+                return build_string(unixfrom, *args, **kwargs)
+            return serialize_headers(msg) + cached.body
+        msg.as_string = msg.as_bytes = as_string
+        return msg
+
+
+def get_mime_cached_class(email_message_class):
+    """
+    Returns a subclass of `email_message_class` which caches the MIME
+    serialization of identical messages.
+    """
+    return extend_message_class(email_message_class, MIMECacheMixin)
@@ -1,8 +1,14 @@
+from django.conf import settings
 from django.contrib.auth.tokens import default_token_generator
 from django.core.exceptions import ImproperlyConfigured
 from django.core.urlresolvers import reverse
-from django.template import loader
 from django.utils.http import int_to_base36
+from django.utils.translation import get_language
+
+from .instrumentation import timed
+from .loading import render_to_string
+from .localization import localize_template_names
+from .utils import get_site_domain, render_stage, reverse_with_values, static_getter
 
 
 class TemplateEmailMixin(object):
@@ -11,20 +17,65 @@ class TemplateEmailMixin(object):
     """
     template_name = None
 
+    @static_getter('template_name')
     def get_template_names(self):
         if self.template_name is None:
             raise ImproperlyConfigured('No `template_name` provided')
         return [self.template_name]
 
+    def get_fragment_key(self):
+        """
+        Returns the part of the cache key of layout fragments which varies by
+        the email class, the active language and the current site.
+        """
+        email_class = self.__class__
+        return u'{0}.{1}:{2!r}:{3}:{4}'.format(
+            email_class.__module__,
+            email_class.__name__,
+            sorted(getattr(email_class, 'callable_initkwargs', {}).items()),
+            get_language(),
+            getattr(settings, 'SITE_ID', None),
+        )
+
+    @classmethod
+    def get_bulk_context_data(cls, emails):
+        """
+        Returns a context dict for each of `emails`, in order.  This is called
+        once per batch of a bulk send, and with just the email otherwise, so
+        data for many emails can be loaded with one query.
+        """
+        return [{} for email in emails]
+
+    @classmethod
+    def prepare_batch(cls, emails):
+        super(TemplateEmailMixin, cls).prepare_batch(emails)
+        for email, context in zip(emails, cls.get_bulk_context_data(emails)):
+            email.bulk_context = context
+
     def get_context_data(self, **kwargs):
+        if getattr(self, 'recipient', None) is not None:
+            kwargs.setdefault('recipient', self.recipient)
+        kwargs.setdefault('email_fragment_key', self.get_fragment_key())
+        if 'bulk_context' not in self.__dict__:
+            self.bulk_context = self.get_bulk_context_data([self])[0]
+        for key, value in self.bulk_context.items():
+            kwargs.setdefault(key, value)
         return kwargs
 
-    def get_rendered_template(self):
-        return loader.render_to_string(
-            self.get_template_names(),
+    def render_template(self):
+        return render_to_string(
+            localize_template_names(self.get_template_names(), self.get_language()),
             self.get_context_data(),
         )
 
+    @render_stage
+    def get_rendered_template(self):
+        with timed(self.__class__, 'template'):
+            return self.render_template()
+
+    def clear_rendered(self):
+        self.__dict__.pop('_rendered_stages', None)
+
     def get_body(self):
         return self.get_rendered_template()
 
@@ -34,12 +85,15 @@ class BuildAbsoluteURIMixin(object):
     Mixin which provides methods for constructing absolute uris.
     """
     protocol = 'http'
+    domain = None
 
+    @static_getter('domain')
     def get_domain(self):
-        from django.contrib.sites.models import Site
-        
-        return Site.objects.get_current().domain
+        if self.domain is None:
+            self.domain = get_site_domain()
+        return self.domain
 
+    @static_getter('protocol')
     def get_protocol(self):
         return self.protocol
 
@@ -74,9 +128,32 @@ class UserTokenEmailMixin(BuildAbsoluteURIMixin):
     def get_uid(self, user):
         return int_to_base36(user.pk)
 
+    def get_user_tokens(self, user):
+        """
+        Returns the uid and token of `user`, generating them only once per
+        user for this email, or for each batch of a bulk send.
+        """
+        user_tokens = self.__dict__.setdefault('user_tokens', {})
+        key = user.pk if user.pk is not None else id(user)
+        if key not in user_tokens:
+            user_tokens[key] = (self.get_uid(user), self.generate_token(user))
+        return user_tokens[key]
+
+    @classmethod
+    def prepare_batch(cls, emails):
+        super(UserTokenEmailMixin, cls).prepare_batch(emails)
+        user_tokens = {}
+        for email in emails:
+            email.user_tokens = user_tokens
+            email.get_user_tokens(email.get_user())
+
     def reverse_token_url(self, view_name, args=None, kwargs=None):
-        if kwargs is None:
-            kwargs = {}
-        kwargs.setdefault(self.UID_KWARG, self.get_uid(self.get_user()))
-        kwargs.setdefault(self.TOKEN_KWARG, self.generate_token(self.get_user()))
-        return self.reverse_absolute_uri(view_name, args=args, kwargs=kwargs)
+        kwargs = dict(kwargs or {})
+        uid, token = self.get_user_tokens(self.get_user())
+        values = {}
+        if self.UID_KWARG not in kwargs:
+            values[self.UID_KWARG] = uid
+        if self.TOKEN_KWARG not in kwargs:
+            values[self.TOKEN_KWARG] = token
+        location = reverse_with_values(view_name, args, kwargs, values)
+        return self.build_absolute_uri(location)
@@ -0,0 +1,102 @@
+import multiprocessing
+from collections import deque
+from itertools import islice
+
+from django.db import connections
+
+from .localization import group_by_language, language_activated
+from .utils import chunked, get_email_class_reference, load_email_class
+
+
+# Connections inherited by a worker process, which are kept referenced so
+# they aren't closed when collected.
+_inherited_connections = []
+
+
+def discard_connections():
+    """
+    Makes a worker process open its own database connections.  The ones
+    inherited from the parent process are left open, because closing them
+    would also end the parent's sessions and transactions.
+    """
+    for connection in connections.all():
+        # An in memory database only exists within its connection.
+        if connection.connection is None or connection.settings_dict['NAME'] == ':memory:':
+            continue
+        _inherited_connections.append(connection.connection)
+        connection.connection = None
+
+
+def render_chunk(task):
+    path, attrs, items = task
+    email_class = load_email_class(path, attrs)
+    emails = [email_class.from_bulk_item(item) for item in items]
+    email_class.prepare_batch(emails)
+    messages = {}
+    for language, group in group_by_language(emails):
+        with language_activated(language):
+            for email in group:
+                message = email.get_email_message()
+                message.connection = None
+                messages[id(email)] = message
+    return [messages[id(email)] for email in emails]
+
+
+def render_parallel(email_class, iterable_of_args, processes=None, chunk_size=None, ordered=True):
+    """
+    Builds the email messages for `iterable_of_args` in a pool of worker
+    processes, yielding a list of messages for every `chunk_size` items.  At
+    most two chunks per process are rendered ahead of the consumer.  When
+    `ordered` is false, chunks are yielded as soon as they are rendered
+    rather than in the order of `iterable_of_args`.
+    """
+    path, attrs = get_email_class_reference(email_class)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if chunk_size is None:
+        chunk_size = email_class.get_bulk_batch_size()
+    max_pending = processes * 2
+    chunks = chunked(iterable_of_args, chunk_size)
+    pending = deque()
+
+    # Worker processes must not share the database connections of this one.
+    pool = multiprocessing.Pool(processes, initializer=discard_connections)
+    try:
+        while True:
+            for chunk in islice(chunks, max_pending - len(pending)):
+                pending.append(pool.apply_async(render_chunk, ((path, attrs, chunk),)))
+            if not pending:
+                break
+            if ordered:
+                result = pending.popleft()
+            else:
+                result = next((r for r in pending if r.ready()), None)
+                if result is None:
+                    pending[0].wait(0.01)
+                    continue
+                pending.remove(result)
+            yield result.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def send_parallel(email_class, iterable_of_args, processes=None, chunk_size=None,
+                  ordered=True, progress=None, filters=()):
+    """
+    Renders messages with `render_parallel` and sends them from this process,
+    one connection per chunk.  Messages rejected by `filter_message` are
+    dropped, as in `send_many`.  `progress` is called with the number of
+    messages sent so far after each chunk.
+    """
+    from .base import SendResult
+
+    results = []
+    for messages in render_parallel(email_class, iterable_of_args, processes, chunk_size, ordered):
+        accepted = [message for message in messages if email_class.filter_message(message, filters)]
+        sent = dict(zip(map(id, accepted), email_class.send_message_batch(accepted)))
+        results.extend(sent.get(id(message)) or SendResult(message.recipients(), False) for message in messages)
+        if progress is not None:
+            progress(len(results))
+    return results
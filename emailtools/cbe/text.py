@@ -0,0 +1,148 @@
+import re
+from htmlentitydefs import name2codepoint
+from HTMLParser import HTMLParser
+
+try:
+    from django.utils.encoding import force_text
+except ImportError:  # Django < 1.4.2
+    from django.utils.encoding import force_unicode as force_text
+
+
+DEFAULT_TEXT_CONVERTER = 'emailtools.cbe.text.html_to_text'
+
+BLOCK_TAGS = frozenset([
+    'address', 'article', 'aside', 'blockquote', 'dd', 'div', 'dl', 'dt',
+    'fieldset', 'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5',
+    'h6', 'header', 'hr', 'ol', 'p', 'pre', 'section', 'table', 'tr', 'ul',
+])
+CELL_TAGS = frozenset(['td', 'th'])
+SKIPPED_TAGS = frozenset(['head', 'script', 'style', 'title'])
+
+WHITESPACE_RE = re.compile(r'\s+')
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+
+class TextConverter(HTMLParser):
+    """
+    Converts html into readable plain text in a single pass.  Block elements
+    are separated by blank lines, table cells by spaces, list items are
+    bulleted or numbered, links
+    are followed by their url, and the contents of `<head>`, `<style>` and
+    `<script>` are dropped.
+    """
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.parts = []
+        self.newlines = 0
+        self.line_start = True
+        self.skipping = 0
+        self.preformatted = 0
+        self.lists = []
+        self.links = []
+        self.separate = False
+
+    def write(self, text, strip=True):
+        if self.newlines:
+            if self.parts:
+                self.parts.append('\n' * self.newlines)
+                self.line_start = True
+            self.newlines = 0
+            self.separate = False
+        if self.line_start and strip:
+            text = text.lstrip(' ')
+        elif self.separate and text and not text.startswith(' ') and not self.parts[-1].endswith(' '):
+            text = ' ' + text
+        if text:
+            self.separate = False
+            self.parts.append(text)
+            self.line_start = text.endswith('\n')
+
+    def newline(self, count=1):
+        self.newlines = max(self.newlines, count)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+        if self.skipping:
+            return
+        if tag == 'br':
+            self.newline()
+        elif tag in BLOCK_TAGS:
+            self.newline(1 if self.lists else 2)
+        if tag == 'pre':
+            self.preformatted += 1
+        elif tag == 'ul':
+            self.lists.append(None)
+        elif tag == 'ol':
+            self.lists.append(0)
+        elif tag == 'li':
+            self.newline()
+            bullet = '-'
+            if self.lists and self.lists[-1] is not None:
+                self.lists[-1] += 1
+                bullet = '{0}.'.format(self.lists[-1])
+            self.write('  ' * max(len(self.lists) - 1, 0) + bullet + ' ', strip=False)
+            self.line_start = True
+        elif tag == 'a':
+            self.links.append((dict(attrs).get('href'), len(self.parts)))
+        elif tag == 'img':
+            alt = dict(attrs).get('alt')
+            if alt:
+                self.write(alt)
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+            return
+        if self.skipping:
+            return
+        if tag == 'pre':
+            self.preformatted = max(self.preformatted - 1, 0)
+        elif tag in ('ul', 'ol') and self.lists:
+            self.lists.pop()
+        elif tag == 'a' and self.links:
+            href, start = self.links.pop()
+            text = ''.join(self.parts[start:]).strip()
+            if href and not href.startswith('#') and href != text:
+                self.write(' ({0})'.format(href))
+        if tag in BLOCK_TAGS:
+            self.newline(1 if self.lists else 2)
+        elif tag in CELL_TAGS:
+            self.separate = True
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        if self.preformatted:
+            self.write(data, strip=False)
+        else:
+            self.write(WHITESPACE_RE.sub(' ', data))
+
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(unichr(name2codepoint[name]))
+        else:
+            self.handle_data(u'&{0};'.format(name))
+
+    def handle_charref(self, name):
+        try:
+            if name.lower().startswith('x'):
+                char = unichr(int(name[1:], 16))
+            else:
+                char = unichr(int(name))
+        except (ValueError, OverflowError):
+            char = u'&#{0};'.format(name)
+        self.handle_data(char)
+
+    def get_text(self):
+        text = u''.join(self.parts)
+        text = u'\n'.join(line.rstrip() for line in text.split(u'\n'))
+        return BLANK_LINES_RE.sub(u'\n\n', text).strip()
+
+
+def html_to_text(html):
+    converter = TextConverter()
+    # Non ascii bytestrings can't be joined with the decoded entities.
+    converter.feed(force_text(html))
+    converter.close()
+    return converter.get_text()
@@ -0,0 +1,158 @@
+import smtplib
+import threading
+import time
+from timeit import default_timer
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from .instrumentation import timed
+
+
+def get_smtp_codes(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return [code for code, message in error.recipients.values()]
+    code = getattr(error, 'smtp_code', None)
+    return [] if code is None else [code]
+
+
+def is_transient_error(error):
+    """
+    Returns whether `error` is a temporary SMTP failure, with a 4xx code,
+    which is worth retrying at a lower rate.
+    """
+    codes = get_smtp_codes(error)
+    return bool(codes) and all(400 <= code < 500 for code in codes)
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` messages per second, in bursts of up to `burst` messages.
+    The rate is halved by `decrease`, which also empties the bucket so the
+    next message waits, and raised again by a small step with each
+    `increase`, up to the configured rate.
+    """
+    backoff_factor = 0.5
+    recovery_steps = 100
+
+    def __init__(self, rate, burst=None, min_rate=None):
+        if rate <= 0:
+            raise ValueError('The rate must be positive, not {0!r}'.format(rate))
+        self.max_rate = self.rate = float(rate)
+        self.min_rate = min_rate if min_rate is not None else self.max_rate / 64
+        self.burst = burst if burst is not None else max(self.max_rate, 1)
+        self.tokens = self.burst
+        self.updated = default_timer()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token and returns the number of seconds to wait before using
+        it.
+        """
+        with self.lock:
+            current = default_timer()
+            self.tokens = min(self.tokens + (current - self.updated) * self.rate, self.burst)
+            self.updated = current
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, 0)
+
+    def decrease(self):
+        with self.lock:
+            self.rate = max(self.rate * self.backoff_factor, self.min_rate)
+            # Retries wait for a new token, so each backoff waits twice as
+            # long as the last.
+            self.tokens = min(self.tokens, 0)
+            self.updated = default_timer()
+
+    def increase(self):
+        with self.lock:
+            self.rate = min(self.rate + self.max_rate / self.recovery_steps, self.max_rate)
+
+
+class Throttle(object):
+    """
+    Limits the rate of messages sent through each backend, configured by
+    backend import path in `rates`, and to each recipient domain, configured
+    in `domain_rates` with `'*'` for any other domain.  Messages which fail
+    with a 4xx response are retried up to `retries` times, after lowering the
+    rate of their backend and domains.
+    """
+    def __init__(self, rates=None, domain_rates=None, retries=3, sleep=time.sleep):
+        for name, rate in list((rates or {}).items()) + list((domain_rates or {}).items()):
+            if rate <= 0:
+                raise ImproperlyConfigured('The email rate limit of {0} must be positive, not {1!r}'.format(name, rate))
+        self.rates = rates or {}
+        self.domain_rates = domain_rates or {}
+        self.retries = retries
+        self.sleep = sleep
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def get_bucket(self, key, rate):
+        with self.lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(rate)
+            return self.buckets[key]
+
+    def get_backend_key(self, connection):
+        return '{0}.{1}'.format(connection.__class__.__module__, connection.__class__.__name__)
+
+    def get_buckets(self, connection, message):
+        buckets = []
+        backend = self.get_backend_key(connection)
+        if backend in self.rates:
+            buckets.append(self.get_bucket(('backend', backend), self.rates[backend]))
+        domains = set(address.rpartition('@')[2].rstrip('>').lower() for address in message.recipients())
+        for domain in sorted(domains):
+            rate = self.domain_rates.get(domain, self.domain_rates.get('*'))
+            if rate is not None:
+                buckets.append(self.get_bucket(('domain', domain), rate))
+        return buckets
+
+    def wait(self, buckets, email_class):
+        delay = max([bucket.reserve() for bucket in buckets])
+        if delay:
+            with timed(email_class, 'throttle'):
+                self.sleep(delay)
+
+    def send(self, connection, message, email_class):
+        buckets = self.get_buckets(connection, message)
+        if not buckets:
+            return connection.send_messages([message])
+        attempt = 0
+        while True:
+            self.wait(buckets, email_class)
+            try:
+                sent = connection.send_messages([message])
+            except Exception as error:
+                if attempt >= self.retries or not is_transient_error(error):
+                    raise
+                attempt += 1
+                for bucket in buckets:
+                    bucket.decrease()
+            else:
+                for bucket in buckets:
+                    bucket.increase()
+                return sent
+
+
+_throttles = {}
+_throttles_lock = threading.Lock()
+
+
+def get_default_throttle():
+    """
+    Returns the process wide throttle configured by `EMAIL_RATE_LIMITS` and
+    `EMAIL_DOMAIN_RATE_LIMITS`, or `None` if no limits are configured.
+    """
+    rates = getattr(settings, 'EMAIL_RATE_LIMITS', None) or {}
+    domain_rates = getattr(settings, 'EMAIL_DOMAIN_RATE_LIMITS', None) or {}
+    if not rates and not domain_rates:
+        return None
+    retries = getattr(settings, 'EMAIL_THROTTLE_RETRIES', 3)
+    key = (tuple(sorted(rates.items())), tuple(sorted(domain_rates.items())), retries)
+    with _throttles_lock:
+        if key not in _throttles:
+            _throttles[key] = Throttle(rates, domain_rates, retries)
+        return _throttles[key]
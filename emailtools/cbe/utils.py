@@ -0,0 +1,326 @@
+import threading
+from functools import wraps
+from importlib import import_module
+from itertools import islice
+
+try:
+    from collections import OrderedDict
+except ImportError:  # Python 2.6
+    from django.utils.datastructures import SortedDict as OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.urlresolvers import get_script_prefix, get_urlconf, reverse
+from django.db.models.signals import post_delete, post_save
+from django.utils import translation
+
+
+def render_stage(func):
+    """
+    Caches the return value of a no-argument rendering method on the email
+    instance, so that each stage of the render pipeline only runs once per
+    message.
+    """
+    name = func.__name__
+
+    @wraps(func)
+    def inner(self):
+        stages = self.__dict__.setdefault('_rendered_stages', {})
+        if name not in stages:
+            stages[name] = func(self)
+        return stages[name]
+    return inner
+
+
+def static_getter(attribute):
+    """
+    Marks a getter whose value only depends on the class attribute
+    `attribute`, so that it can be frozen into the spec of callable email
+    classes when the attribute is set.
+    """
+    def decorator(func):
+        func.static_attribute = attribute
+        return func
+    return decorator
+
+
+def get_static_value(email_class, attribute):
+    for klass in email_class.__mro__:
+        if attribute in klass.__dict__:
+            value = klass.__dict__[attribute]
+            if hasattr(value, '__get__'):
+                return None
+            return value
+    return None
+
+
+class EmailSpec(object):
+    """
+    The values of the static getters of an email class, resolved once.  A
+    getter is only resolved if it hasn't been overridden and its attribute is
+    set to a plain value on the class itself.  Inherited attributes are left
+    to the getters, so changes to the base classes still apply.
+    """
+    __slots__ = ('email_class', 'values', 'attributes')
+
+    def __init__(self, email_class):
+        self.email_class = email_class
+        self.values = {}
+        self.attributes = {}
+        instance = email_class.__new__(email_class)
+        for name in dir(email_class):
+            if not name.startswith('get_'):
+                continue
+            attribute = getattr(getattr(email_class, name), 'static_attribute', None)
+            if attribute not in email_class.__dict__ or get_static_value(email_class, attribute) is None:
+                continue
+            self.values[name] = getattr(instance, name)()
+            self.attributes[name] = attribute
+
+
+def frozen_getter(email_class, name, attribute, value):
+    getter = getattr(email_class, name).im_func
+
+    def get_value(self):
+        if self.__class__ is not email_class or attribute in self.__dict__:
+            return getter(self)
+        return value
+    get_value.__name__ = name
+    return get_value
+
+
+def compile_email_class(email_class):
+    """
+    Replaces the static getters of `email_class` with ones returning the
+    values frozen in its `spec`.  Instances which set the attribute of a
+    getter, and subclasses, still use the original getter.
+    """
+    spec = EmailSpec(email_class)
+    for name, value in spec.values.items():
+        setattr(email_class, name, frozen_getter(email_class, name, spec.attributes[name], value))
+    email_class.spec = spec
+    return email_class
+
+
+def chunked(iterable, size):
+    """
+    Lazily splits `iterable` into lists of at most `size` items.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def split_call_args(item):
+    """
+    Converts one item of a bulk send into the `(args, kwargs)` used to
+    instantiate an email.  Tuples are positional arguments, dicts are keyword
+    arguments and anything else is a single positional argument.
+    """
+    if isinstance(item, tuple):
+        return item, {}
+    if isinstance(item, dict):
+        return (), item
+    return (item,), {}
+
+
+class LRUCache(object):
+    """
+    Thread safe mapping which holds at most `maxsize` items, discarding the
+    least recently used item when full.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.data.pop(key)
+            except KeyError:
+                return default
+            self.data[key] = value
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = value
+            while len(self.data) > self.maxsize:
+                del self.data[next(iter(self.data))]
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def __len__(self):
+        return len(self.data)
+
+
+_message_classes = {}
+_message_classes_lock = threading.Lock()
+
+
+def build_message_class(base, mixins):
+    key = (base, mixins)
+    with _message_classes_lock:
+        if key not in _message_classes:
+            _message_classes[key] = type(
+                ''.join(mixin.__name__ for mixin in mixins) + base.__name__,
+                mixins + (base,),
+                {'message_base': base, 'message_mixins': mixins, '__reduce__': reduce_message},
+            )
+        return _message_classes[key]
+
+
+def reduce_message(message):
+    # The generated class can't be imported, so messages are pickled as the
+    # importable base class and mixins they are rebuilt from.
+    state = message.__getstate__() if hasattr(message, '__getstate__') else message.__dict__
+    return rebuild_message, (message.message_base, message.message_mixins, state)
+
+
+def rebuild_message(base, mixins, state):
+    message_class = build_message_class(base, mixins)
+    message = message_class.__new__(message_class)
+    message.__dict__.update(state)
+    return message
+
+
+def extend_message_class(message_class, mixin):
+    """
+    Returns a subclass of the email message class `message_class` with
+    `mixin` applied.  Each subclass is created once, and its instances can
+    be pickled as long as `mixin` and the original message class can be
+    imported.
+    """
+    mixins = getattr(message_class, 'message_mixins', ())
+    if mixin in mixins:
+        return message_class
+    return build_message_class(getattr(message_class, 'message_base', message_class), (mixin,) + mixins)
+
+
+def get_email_class_reference(email_class):
+    """
+    Returns the import path of `email_class` along with the attributes that
+    were overridden by `as_callable`, so that the class can be rebuilt with
+    `load_email_class` in another process.
+    """
+    attrs = {}
+    while 'callable_initkwargs' in email_class.__dict__:
+        attrs = dict(email_class.callable_initkwargs, **attrs)
+        email_class = email_class.__bases__[0]
+    module = import_module(email_class.__module__)
+    if getattr(module, email_class.__name__, None) is not email_class:
+        raise ImproperlyConfigured(
+            "{0} can't be imported from {1}".format(email_class.__name__, email_class.__module__)
+        )
+    return '{0}.{1}'.format(email_class.__module__, email_class.__name__), attrs
+
+
+def import_string(path):
+    module_name, name = path.rsplit('.', 1)
+    return getattr(import_module(module_name), name)
+
+
+def load_email_class(path, attrs=None):
+    email_class = import_string(path)
+    if attrs:
+        email_class = email_class.get_callable_class(**attrs)
+    return email_class
+
+
+def compile_url_template(url, values):
+    """
+    Splits `url` around each of the `values` it was reversed with, returning
+    a list of alternating literal segments and keys of `values`.  Returns
+    `None` unless each value occurs exactly once in `url`.
+    """
+    positions = []
+    for key, value in values.items():
+        value = str(value)
+        if not value or url.count(value) != 1:
+            return None
+        start = url.index(value)
+        positions.append((start, start + len(value), key))
+    positions.sort()
+    template = []
+    end = 0
+    for start, next_end, key in positions:
+        if start < end:
+            return None
+        template.extend([url[end:start], key])
+        end = next_end
+    template.append(url[end:])
+    return template
+
+
+def render_url_template(template, values):
+    parts = list(template)
+    for i in range(1, len(parts), 2):
+        parts[i] = str(values[parts[i]])
+    return ''.join(parts)
+
+
+_url_templates = LRUCache(256)
+
+
+def reverse_with_values(view_name, args, kwargs, values):
+    """
+    Reverses `view_name` with `kwargs` and `values` combined.  The reversed
+    url is cached as a template, so that reversing it again with different
+    `values` is a string substitution.  The `values` must always match the
+    url pattern they are reversed into.
+    """
+    key = (
+        get_urlconf(), get_script_prefix(), translation.get_language(), view_name, tuple(args or ()),
+        tuple(sorted(kwargs.items())), tuple(sorted(values)),
+    )
+    try:
+        template = _url_templates.get(key)
+    except TypeError:
+        # Unhashable arguments can't be cached.
+        key = template = None
+    if template is not None:
+        return render_url_template(template, values)
+    url = reverse(view_name, args=args, kwargs=dict(kwargs, **values))
+    if key is not None:
+        template = compile_url_template(url, values)
+        if template is not None:
+            _url_templates.set(key, template)
+    return url
+
+
+_site_domains = {}
+
+
+def get_site_domain():
+    """
+    Returns `settings.EMAIL_SITE_DOMAIN`, or the domain of the current
+    `Site`, which is only looked up once per `SITE_ID` until
+    `clear_site_domain_cache` is called, as it is when a `Site` is saved or
+    deleted.
+    """
+    domain = getattr(settings, 'EMAIL_SITE_DOMAIN', None)
+    if domain is not None:
+        return domain
+    site_id = getattr(settings, 'SITE_ID', None)
+    if site_id not in _site_domains:
+        from django.contrib.sites.models import Site
+
+        # Connected here rather than in `emailtools.models`, so the cache is
+        # cleared even when emailtools isn't an installed app.
+        post_save.connect(clear_site_domain_cache, sender=Site, dispatch_uid='emailtools.site_domain')
+        post_delete.connect(clear_site_domain_cache, sender=Site, dispatch_uid='emailtools.site_domain')
+        _site_domains[site_id] = Site.objects.get_current().domain
+    return _site_domains[site_id]
+
+
+def clear_site_domain_cache(**kwargs):
+    _site_domains.clear()
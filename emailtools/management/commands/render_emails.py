@@ -0,0 +1,87 @@
+import json
+import os
+from itertools import cycle, islice
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from emailtools.cbe.utils import load_email_class
+
+
+def read_items(path):
+    """
+    Yields the calling arguments in the JSON lines file at `path`.  Lists are
+    positional arguments, objects are keyword arguments and anything else is
+    a single argument.
+    """
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            yield tuple(item) if isinstance(item, list) else item
+
+
+class Command(BaseCommand):
+    help = ('Builds the messages of an email class without sending them, and '
+            'reports the throughput, message size and memory use.')
+    args = '<email class path>'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--count', type='int', dest='count',
+                    help='The number of messages to build.  Defaults to the number of '
+                         'items in --args-file, or 100.'),
+        make_option('--args-file', dest='args_file',
+                    help='A JSON lines file with the calling arguments of each email, '
+                         'which are reused in turn for --count messages.'),
+        make_option('--attrs', dest='attrs',
+                    help='A JSON object of attributes to override, as with as_callable.'),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    help='The number of emails prepared at a time.'),
+        make_option('--sample-dir', dest='sample_dir',
+                    help='Write the first --samples messages to this directory.'),
+        make_option('--samples', type='int', dest='samples', default=5,
+                    help='The number of messages written to --sample-dir.'),
+        make_option('--json', action='store_true', dest='json', default=False,
+                    help='Write the report as JSON.'),
+    )
+
+    def get_items(self, args_file, count):
+        if args_file is None:
+            return [()] * (100 if count is None else count)
+        if count is None:
+            return read_items(args_file)
+        return islice(cycle(list(read_items(args_file))), count)
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the import path of one email class.')
+        attrs = json.loads(options['attrs']) if options.get('attrs') else None
+        try:
+            email_class = load_email_class(args[0], attrs)
+        except (ImportError, AttributeError, ValueError) as e:
+            raise CommandError("Can't load {0}: {1}".format(args[0], e))
+
+        sample_dir = options.get('sample_dir')
+        report = email_class.render_many(
+            self.get_items(options.get('args_file'), options.get('count')),
+            batch_size=options.get('batch_size'),
+            sample=options['samples'] if sample_dir else 0,
+        )
+        for index, message in enumerate(report.samples):
+            with open(os.path.join(sample_dir, 'message-{0}.eml'.format(index)), 'w') as f:
+                f.write(message.message().as_string())
+
+        if options['json']:
+            self.stdout.write(json.dumps(report.as_dict(), indent=2, sort_keys=True) + '\n')
+            return
+        self.stdout.write('{0} messages in {1:.2f}s: {2:.1f} messages/sec, {3:.0f} bytes/message\n'.format(
+            report.count, report.duration, report.messages_per_second, report.bytes_per_message,
+        ))
+        if report.peak_memory is not None:
+            self.stdout.write('Peak memory: {0:.1f} MB\n'.format(report.peak_memory / 1048576.0))
+        for phase, stats in sorted(report.phases.items()):
+            self.stdout.write('{0:<10} {1:>8} {2:>10.1f}us p50 {3:>10.1f}us p95 {4:>10.1f}us p99 {5:>10} bytes\n'.format(
+                phase, stats['count'], stats['p50'] * 1e6, stats['p95'] * 1e6, stats['p99'] * 1e6,
+                stats.get('memory', '-'),
+            ))
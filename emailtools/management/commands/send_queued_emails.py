@@ -0,0 +1,31 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from emailtools.worker import send_queued_emails
+
+
+class Command(NoArgsCommand):
+    help = 'Renders and sends the emails waiting in the email queue.'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size',
+                    help='The number of emails claimed at a time.'),
+        make_option('--loop', action='store_true', dest='loop', default=False,
+                    help='Keep polling the queue for new emails.'),
+        make_option('--interval', type='float', dest='interval', default=5,
+                    help='Seconds to wait when the queue is empty in --loop mode.'),
+    )
+
+    def handle_noargs(self, batch_size=None, loop=False, interval=5, **options):
+        verbosity = int(options.get('verbosity', 1))
+        while True:
+            claimed = send_queued_emails(batch_size=batch_size)
+            if claimed and verbosity > 1:
+                self.stdout.write('Processed {0} queued emails\n'.format(claimed))
+            if claimed:
+                continue
+            if not loop:
+                break
+            time.sleep(interval)
@@ -0,0 +1,234 @@
+import base64
+import cPickle as pickle
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, models, transaction
+from django.db.models.signals import post_delete
+from django.utils import translation
+try:
+    from django.utils.timezone import now
+except ImportError:  # Django < 1.4
+    now = datetime.datetime.now
+
+from .cbe.utils import get_email_class_reference, load_email_class
+from .suppression import reload_suppression_stores
+
+atomic = getattr(transaction, 'atomic', None) or transaction.commit_on_success
+
+
+def get_lease():
+    return getattr(settings, 'EMAIL_QUEUE_LEASE', 300)
+
+
+def get_max_attempts():
+    return getattr(settings, 'EMAIL_QUEUE_MAX_ATTEMPTS', 5)
+
+
+def supports_skip_locked(connection):
+    """
+    Returns whether the database of `connection` supports `SELECT ... FOR
+    UPDATE SKIP LOCKED`, which PostgreSQL does from 9.5.
+    """
+    if hasattr(connection.features, 'has_select_for_update_skip_locked'):
+        return connection.features.has_select_for_update_skip_locked
+    return connection.vendor == 'postgresql' and connection.pg_version >= 90500
+
+
+class QueuedEmailManager(models.Manager):
+    def enqueue(self, email, send_at=None):
+        try:
+            args, kwargs = email.args, email.kwargs
+        except AttributeError:
+            raise ImproperlyConfigured(
+                '{0} must set `args` and `kwargs` in `__init__` to be '
+                'enqueued'.format(email.__class__.__name__)
+            )
+        path, attrs = get_email_class_reference(email.__class__)
+        queued = self.model(email_class=path, next_attempt=send_at or now())
+        queued.set_data(attrs, args, kwargs, translation.get_language())
+        queued.save(using=self._db)
+        return queued
+
+    def claimable(self, when, max_attempts):
+        return self.filter(
+            status__in=(self.model.QUEUED, self.model.SENDING),
+            next_attempt__lte=when,
+            attempts__lt=max_attempts,
+        ).order_by('next_attempt', 'pk')
+
+    def claim(self, batch_size, lease=None, max_attempts=None):
+        """
+        Marks up to `batch_size` due emails as being sent and returns them.
+        Emails which are still marked as being sent once `lease` seconds have
+        passed are claimed again, in case the worker sending them has died,
+        unless they have already been claimed `max_attempts` times, in which
+        case they are marked as failed.
+
+        On databases which support `SELECT ... FOR UPDATE SKIP LOCKED`,
+        concurrent workers skip the rows locked by each other.  Elsewhere each
+        row is claimed with a conditional update on its `attempts` counter.
+        """
+        if lease is None:
+            lease = get_lease()
+        if max_attempts is None:
+            max_attempts = get_max_attempts()
+        claimed_at = now()
+        self.filter(
+            status=self.model.SENDING,
+            next_attempt__lte=claimed_at,
+            attempts__gte=max_attempts,
+        ).update(status=self.model.FAILED, last_error='The lease expired on the last attempt.')
+        values = {
+            'status': self.model.SENDING,
+            'attempts': models.F('attempts') + 1,
+            'next_attempt': claimed_at + datetime.timedelta(seconds=lease),
+        }
+        connection = connections[self.db]
+        if supports_skip_locked(connection):
+            quote_name = connection.ops.quote_name
+            with atomic(using=self.db):
+                cursor = connection.cursor()
+                cursor.execute(
+                    'SELECT {0} FROM {1} WHERE status IN (%s, %s) AND next_attempt <= %s '
+                    'AND attempts < %s ORDER BY next_attempt, {0} LIMIT %s '
+                    'FOR UPDATE SKIP LOCKED'.format(
+                        quote_name(self.model._meta.pk.column),
+                        quote_name(self.model._meta.db_table),
+                    ),
+                    [self.model.QUEUED, self.model.SENDING, claimed_at, max_attempts, batch_size],
+                )
+                pks = [row[0] for row in cursor.fetchall()]
+                self.filter(pk__in=pks).update(**values)
+        else:
+            pks = []
+            candidates = self.claimable(claimed_at, max_attempts).values_list('pk', 'attempts')[:batch_size]
+            for pk, attempts in candidates:
+                if self.filter(pk=pk, attempts=attempts).update(**values):
+                    pks.append(pk)
+        return list(self.filter(pk__in=pks).order_by('pk'))
+
+
+class QueuedEmail(models.Model):
+    """
+    An email waiting to be rendered and sent by the `send_queued_emails`
+    management command.
+    """
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, 'Queued'),
+        (SENDING, 'Sending'),
+        (FAILED, 'Failed'),
+    )
+
+    email_class = models.CharField(max_length=255)
+    data = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=now, db_index=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=now)
+
+    objects = QueuedEmailManager()
+
+    def __unicode__(self):
+        return u'{0} ({1})'.format(self.email_class, self.status)
+
+    def set_data(self, attrs, args, kwargs, language=None):
+        data = (attrs, args, kwargs, language)
+        self.data = base64.b64encode(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+    def get_data(self):
+        """
+        Returns `(attrs, args, kwargs, language)`, where `language` is the
+        language active when the email was enqueued.
+        """
+        data = pickle.loads(base64.b64decode(self.data))
+        # Emails enqueued before the language was stored.
+        return data if len(data) == 4 else data + (None,)
+
+    def get_email(self):
+        attrs, args, kwargs, language = self.get_data()
+        return load_email_class(self.email_class, attrs)(*args, **kwargs)
+
+    def get_language(self):
+        return self.get_data()[3]
+
+    def get_claim(self):
+        """
+        Returns the row of the email while it is still claimed by this
+        instance.  Claiming it again increments `attempts`, so once the lease
+        has expired and another worker has claimed it, the row isn't returned.
+        """
+        return QueuedEmail.objects.filter(pk=self.pk, status=self.SENDING, attempts=self.attempts)
+
+    def renew(self, lease=None):
+        """
+        Extends the claim on the email by `lease` seconds, and returns whether
+        it was still held.
+        """
+        if lease is None:
+            lease = get_lease()
+        self.next_attempt = now() + datetime.timedelta(seconds=lease)
+        return bool(self.get_claim().update(next_attempt=self.next_attempt))
+
+    def sent(self):
+        self.get_claim().delete()
+
+    def retry(self, error, max_attempts=None, retry_delay=None):
+        """
+        Schedules the email to be sent again with an exponential backoff, or
+        marks it as failed once it has been attempted `max_attempts` times.
+        """
+        if max_attempts is None:
+            max_attempts = get_max_attempts()
+        if retry_delay is None:
+            retry_delay = getattr(settings, 'EMAIL_QUEUE_RETRY_DELAY', 60)
+        claim = self.get_claim()
+        self.last_error = error
+        if self.attempts >= max_attempts:
+            self.status = self.FAILED
+        else:
+            self.status = self.QUEUED
+            delay = retry_delay * 2 ** (self.attempts - 1)
+            self.next_attempt = now() + datetime.timedelta(seconds=delay)
+        claim.update(status=self.status, last_error=error, next_attempt=self.next_attempt)
+
+    def requeue(self):
+        self.status = self.QUEUED
+        self.attempts = 0
+        self.next_attempt = now()
+        self.save()
+
+
+class SuppressedAddress(models.Model):
+    """
+    An address which emails with `suppress_recipients` set are not sent to.
+    """
+    BOUNCE = 'bounce'
+    COMPLAINT = 'complaint'
+    UNSUBSCRIBE = 'unsubscribe'
+    REASON_CHOICES = (
+        (BOUNCE, 'Bounce'),
+        (COMPLAINT, 'Complaint'),
+        (UNSUBSCRIBE, 'Unsubscribe'),
+    )
+
+    address = models.CharField(max_length=254, unique=True)
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES, default=UNSUBSCRIBE)
+    created_at = models.DateTimeField(default=now)
+
+    def __unicode__(self):
+        return u'{0} ({1})'.format(self.address, self.reason)
+
+    def save(self, *args, **kwargs):
+        self.address = self.address.strip().lower()
+        super(SuppressedAddress, self).save(*args, **kwargs)
+
+
+# Stores only pick up new addresses incrementally, so removing an address
+# requires them to be loaded again.
+post_delete.connect(reload_suppression_stores, sender=SuppressedAddress)
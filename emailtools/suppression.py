@@ -0,0 +1,233 @@
+import hashlib
+import heapq
+import math
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from email.utils import parseaddr
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import smart_str
+
+from .cbe.utils import import_string
+
+
+# The widest unsigned typecode, as 'Q' is missing on Python 2 and 'L' is
+# only 4 bytes on some platforms.
+HASH_TYPECODE = 'L'
+try:
+    if array('Q').itemsize > array(HASH_TYPECODE).itemsize:
+        HASH_TYPECODE = 'Q'
+except ValueError:  # Python 2
+    pass
+HASH_MASK = (1 << (8 * array(HASH_TYPECODE).itemsize)) - 1
+
+
+def normalize_address(address):
+    name, email = parseaddr(address)
+    return (email or address).strip().lower()
+
+
+def address_hash(address):
+    """
+    Returns a fixed size integer hash of the normalized `address`.
+    """
+    digest = hashlib.sha1(smart_str(normalize_address(address))).hexdigest()
+    return int(digest[:16], 16) & HASH_MASK
+
+
+class BloomFilter(object):
+    """
+    Probabilistic set of address hashes, which never gives false negatives.
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(capacity, 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hash_count = max(int(round(float(self.size) / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, value):
+        step = (value >> 17) | 1
+        for i in range(self.hash_count):
+            yield (value + i * step) % self.size
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        for position in self.positions(value):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class SuppressionIndex(object):
+    """
+    In memory index of suppressed address hashes.  Lookups are answered by a
+    bloom filter, and confirmed against a sorted array of the hashes.
+    """
+    def __init__(self, hashes=()):
+        self.hashes = array(HASH_TYPECODE)
+        self.bloom = BloomFilter(1)
+        self.add(hashes)
+
+    def add(self, hashes):
+        new_hashes = sorted(set(hashes))
+        if not new_hashes:
+            return
+        merged = array(HASH_TYPECODE)
+        previous = None
+        for value in heapq.merge(self.hashes, new_hashes):
+            if value != previous:
+                merged.append(value)
+                previous = value
+        self.hashes = merged
+        if len(merged) > self.bloom.capacity:
+            self.bloom = BloomFilter(len(merged) * 2)
+            new_hashes = merged
+        for value in new_hashes:
+            self.bloom.add(value)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, value):
+        if value not in self.bloom:
+            return False
+        index = bisect_left(self.hashes, value)
+        return index < len(self.hashes) and self.hashes[index] == value
+
+
+class BaseSuppressionStore(object):
+    """
+    Source of suppressed addresses, which are bulk loaded into a
+    `SuppressionIndex` and then refreshed incrementally at most every
+    `refresh_interval` seconds.  Every `reload_interval` seconds they are
+    loaded again in full, so removed addresses are eventually dropped.
+    """
+    def __init__(self, refresh_interval=None, reload_interval=None):
+        if refresh_interval is None:
+            refresh_interval = getattr(settings, 'EMAIL_SUPPRESSION_REFRESH_INTERVAL', 60)
+        if reload_interval is None:
+            reload_interval = getattr(settings, 'EMAIL_SUPPRESSION_RELOAD_INTERVAL', 3600)
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self.index = None
+        self.marker = None
+        self.refreshed_at = 0
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, marker):
+        """
+        Returns `(addresses, marker, complete)`, where `addresses` are the
+        addresses added since `marker`, or every address when `complete` is
+        true.  The returned `marker` is passed to the next call, and a
+        `marker` of `None` asks for every address.
+        """
+        raise NotImplementedError
+
+    def reload(self):
+        with self.lock:
+            self.index = None
+            self.marker = None
+
+    def get_index(self):
+        with self.lock:
+            if self.index is not None and time.time() - self.refreshed_at < self.refresh_interval:
+                return self.index
+            if time.time() - self.loaded_at >= self.reload_interval:
+                self.marker = None
+            addresses, self.marker, complete = self.fetch(self.marker)
+            hashes = (address_hash(address) for address in addresses)
+            if complete or self.index is None:
+                self.index = SuppressionIndex(hashes)
+                self.loaded_at = time.time()
+            else:
+                self.index.add(hashes)
+            self.refreshed_at = time.time()
+            return self.index
+
+    def is_suppressed(self, address):
+        return address_hash(address) in self.get_index()
+
+    def filter(self, addresses):
+        """
+        Returns the addresses which are not suppressed.
+        """
+        index = self.get_index()
+        return [address for address in addresses if address_hash(address) not in index]
+
+
+class DatabaseSuppressionStore(BaseSuppressionStore):
+    """
+    Loads the addresses stored as `emailtools.models.SuppressedAddress`.
+    Deleted addresses are only dropped by other processes at their next full
+    reload.
+    """
+    def fetch(self, marker):
+        from emailtools.models import SuppressedAddress
+
+        complete = marker is None
+        queryset = SuppressedAddress.objects.order_by('pk')
+        if not complete:
+            queryset = queryset.filter(pk__gt=marker)
+        addresses = []
+        for pk, address in queryset.values_list('pk', 'address').iterator():
+            addresses.append(address)
+            marker = pk
+        return addresses, marker, complete
+
+
+class FileSuppressionStore(BaseSuppressionStore):
+    """
+    Loads addresses from a file with one address per line, such as
+    `settings.EMAIL_SUPPRESSION_FILE`.  Lines appended to the file are picked
+    up incrementally, and the file is reloaded when it is replaced or
+    truncated.
+    """
+    def __init__(self, path=None, refresh_interval=None, reload_interval=None):
+        super(FileSuppressionStore, self).__init__(refresh_interval, reload_interval)
+        if path is None:
+            path = settings.EMAIL_SUPPRESSION_FILE
+        self.path = path
+
+    def fetch(self, marker):
+        stat = os.stat(self.path)
+        complete = marker is None or marker[0] != stat.st_ino or marker[1] > stat.st_size
+        offset = 0 if complete else marker[1]
+        with open(self.path, 'rb') as suppression_file:
+            suppression_file.seek(offset)
+            data = suppression_file.read()
+        # Only read up to the last complete line.
+        data = data[:data.rfind('\n') + 1]
+        addresses = [line.strip() for line in data.splitlines() if line.strip()]
+        return addresses, (stat.st_ino, offset + len(data)), complete
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_suppression_store():
+    """
+    Returns the store configured by `settings.EMAIL_SUPPRESSION_STORE`.
+    """
+    path = getattr(settings, 'EMAIL_SUPPRESSION_STORE', None)
+    if path is None:
+        raise ImproperlyConfigured(
+            '`suppress_recipients` requires `settings.EMAIL_SUPPRESSION_STORE`'
+        )
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = import_string(path)()
+        return _stores[path]
+
+
+def reload_suppression_stores(**kwargs):
+    for store in list(_stores.values()):
+        store.reload()
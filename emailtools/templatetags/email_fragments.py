@@ -0,0 +1,43 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from emailtools.cbe.fragments import render_fragment
+
+
+register = template.Library()
+
+
+class EmailFragmentNode(template.Node):
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        vary_on = [context.get('email_fragment_key')]
+        vary_on.extend(value.resolve(context) for value in self.vary_on)
+        return mark_safe(render_fragment(self.name, vary_on, lambda: self.nodelist.render(context)))
+
+
+@register.tag
+def emailfragment(parser, token):
+    """
+    Caches the contents of the block, for layout regions which are the same
+    for every message of an email class, language and site.
+
+    Usage::
+
+        {% load email_fragments %}
+        {% emailfragment footer [var1] [var2] ... %}
+            .. static content ..
+        {% endemailfragment %}
+
+    Fragment names must be unique across layouts.  Additional arguments are
+    added to the cache key, for regions which also vary by them.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError("'{0}' tag requires at least 1 argument.".format(bits[0]))
+    nodelist = parser.parse(('endemailfragment',))
+    parser.delete_first_token()
+    return EmailFragmentNode(nodelist, bits[1], [parser.compile_filter(bit) for bit in bits[2:]])
@@ -1,5 +1,31 @@
+import asyncore
+import json
+import os
+import pickle
+import shutil
+import smtpd
+import smtplib
+import sys
+import tempfile
+import threading
+from array import array
+from email import message_from_string
+from io import BytesIO
+from StringIO import StringIO
+
 import django
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
 from django.core import mail
+from django.core.mail import EmailMessage
+from django.core.urlresolvers import clear_url_caches, reverse
+from django.db import connections
+from django.core.management import call_command
+from django.core.mail.backends import locmem
+from django.template import Context
+from django.utils import translation
+from django.utils.translation import ugettext_lazy
+from django.utils.http import int_to_base36
 from django.test import TestCase
 try:
     try:
@@ -16,7 +42,86 @@ except ImportError:
 from django.core.exceptions import ImproperlyConfigured
 
 
-from emailtools import BaseEmail, BasicEmail, HTMLEmail, MarkdownEmail
+from emailtools import BaseEmail, BasicEmail, BulkSendError, HTMLEmail, MarkdownEmail
+from emailtools.backends.smtp import PooledEmailBackend, get_connection_pool
+from emailtools.cbe.fragments import clear_fragment_cache, get_fragment_cache
+from emailtools.cbe.attachments import Attachment, clear_attachment_cache, get_attachment_cache
+from emailtools.cbe.css import compile_selector, get_stylesheet, inline_css
+from emailtools.cbe.executor import EmailExecutor, SendTimeout
+from emailtools.cbe.instrumentation import email_phase_timed, instrument
+from emailtools.cbe.lazy import LazyEmailMessage, UniqueRecipients
+from emailtools.cbe.loading import clear_template_cache, get_template
+from emailtools.cbe.localization import localize_template_names
+from emailtools.cbe.markup import get_markdown_cache, get_markdown_converter
+from emailtools.cbe.mime import clear_mime_cache, get_mime_cache
+from emailtools.cbe.mixins import BuildAbsoluteURIMixin, UserTokenEmailMixin
+from emailtools.cbe.text import html_to_text
+from emailtools.cbe.throttle import Throttle, TokenBucket, get_default_throttle, is_transient_error
+from emailtools.cbe.utils import LRUCache, clear_site_domain_cache, compile_url_template
+from emailtools.models import QueuedEmail, SuppressedAddress, supports_skip_locked
+from emailtools.suppression import (
+    HASH_TYPECODE, DatabaseSuppressionStore, FileSuppressionStore, SuppressionIndex, address_hash,
+    get_suppression_store, reload_suppression_stores,
+)
+from emailtools.worker import send_queued_emails
+
+
+class ImportableEmail(BasicEmail):
+    subject = 'importable email'
+    from_email = 'from@example.com'
+    body = 'This is an importable email'
+
+    def get_to(self):
+        return [self.args[0]]
+
+    def get_body(self):
+        if self.kwargs.get('fail'):
+            raise ValueError('failed to render')
+        return super(ImportableEmail, self).get_body()
+
+
+class PreparedEmail(ImportableEmail):
+    prepared = []
+
+    @classmethod
+    def prepare_batch(cls, emails):
+        PreparedEmail.prepared.append((cls.subject, len(emails)))
+
+
+class UnsentEmailBackend(locmem.EmailBackend):
+    """
+    Reports every message as not sent, as backends which fail silently do.
+    """
+    def send_messages(self, messages):
+        return 0
+
+
+def not_to_b(message):
+    return message.to != ['b@example.com']
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    """
+    Rejects the first `failures` messages with `error`.
+    """
+    def __init__(self, failures=0, error=None, **kwargs):
+        super(FlakyEmailBackend, self).__init__(**kwargs)
+        self.failures = failures
+        self.error = error
+
+    def send_messages(self, messages):
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        return super(FlakyEmailBackend, self).send_messages(messages)
 
 
 class TestBasicCBE(TestCase):
@@ -125,6 +230,41 @@ class TestBasicCBE(TestCase):
         with self.assertRaises(TypeError):
             TestEmail('arst', 'tsra')
 
+    def test_callable_class_compiled(self):
+        class TestEmail(self.TestEmail):
+            def get_from_email(self):
+                return 'dynamic@example.com'
+
+        EmailClass = TestEmail.get_callable_class(subject='compiled')
+        self.assertEqual(EmailClass.spec.values['get_subject'], 'compiled')
+        self.assertNotIn('get_from_email', EmailClass.spec.values)
+        self.assertNotIn('get_to', EmailClass.spec.values)
+        self.assertIs(TestEmail.get_callable_class(subject='compiled'), EmailClass)
+
+        email = EmailClass()
+        self.assertEqual(email.get_subject(), 'compiled')
+        self.assertEqual(email.get_from_email(), 'dynamic@example.com')
+        email.subject = 'instance'
+        self.assertEqual(email.get_subject(), 'instance')
+
+        class SubClass(EmailClass):
+            subject = 'subclass'
+
+        self.assertEqual(SubClass().get_subject(), 'subclass')
+
+    def test_callable_class_inherits_changes(self):
+        send_email = self.TestEmail.as_callable()
+        self.TestEmail.subject = 'changed'
+        send_email()
+        self.TestEmail.as_callable()()
+        self.assertEqual([message.subject for message in mail.outbox], ['changed', 'changed'])
+        self.assertEqual(self.TestEmail.get_callable_class().spec.values, {})
+
+    def test_callable_class_unhashable_kwargs(self):
+        EmailClass = self.TestEmail.get_callable_class(cc=['cc@example.com'])
+        self.assertEqual(EmailClass().get_cc(), ['cc@example.com'])
+        self.assertIsNot(self.TestEmail.get_callable_class(cc=['cc@example.com']), EmailClass)
+
     def test_extra_headers(self):
         class TestEmail(self.TestEmail):
             headers = {
@@ -134,6 +274,174 @@ class TestBasicCBE(TestCase):
         message = TestEmail().get_email_message().message()
         self.assertEqual(message['Test-Header'], 'foo')
 
+    def test_send_many(self):
+        class TestEmail(self.TestEmail):
+            def get_to(self):
+                return [self.args[0]]
+
+        addresses = ['{0}@example.com'.format(i) for i in range(5)]
+        results = TestEmail.send_many(iter(addresses))
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual([message.to for message in mail.outbox],
+                         [[address] for address in addresses])
+        self.assertEqual(results, [([address], True) for address in addresses])
+
+    def test_send_many_call_args(self):
+        class TestEmail(self.TestEmail):
+            def __init__(self, to, subject='default'):
+                self.to = to
+                self.subject = subject
+
+        TestEmail.send_many([('a@example.com',), {'to': 'b@example.com', 'subject': 'b'}])
+        self.assertEqual([(m.to, m.subject) for m in mail.outbox],
+                         [(['a@example.com'], 'default'), (['b@example.com'], 'b')])
+
+    def test_send_to_each(self):
+        class Recipient(object):
+            email = 'object@example.com'
+
+        def recipients():
+            for address in ['a@example.com', 'b@example.com', Recipient(), 'c@example.com']:
+                # Only one batch of recipients is pulled ahead of sending.
+                self.assertTrue(len(mail.outbox) >= pulled[0] - 2)
+                pulled[0] += 1
+                yield address
+        pulled = [0]
+
+        EmailClass = self.TestEmail.get_callable_class(bulk_batch_size=2)
+        self.assertEqual(EmailClass.send_to_each(recipients()), 4)
+        self.assertEqual(
+            [message.to for message in mail.outbox],
+            [['a@example.com'], ['b@example.com'], ['object@example.com'], ['c@example.com']],
+        )
+
+    def test_send_async(self):
+        executor = EmailExecutor(max_workers=2, queue_size=1)
+        send_email = self.TestEmail.as_async_callable(executor=executor)
+        futures = [send_email() for i in range(5)]
+        executor.wait()
+        self.assertTrue(all(future.done() for future in futures))
+        self.assertEqual(len(mail.outbox), 5)
+        executor.shutdown()
+
+    def test_send_async_language(self):
+        executor = EmailExecutor(max_workers=1)
+        send_email = self.TestEmail.as_async_callable(executor=executor, subject=ugettext_lazy('Yes'))
+        with translation.override('fr'):
+            send_email().result(timeout=5)
+        send_email().result(timeout=5)
+        executor.shutdown()
+        self.assertEqual([message.subject for message in mail.outbox], [u'Oui', u'Yes'])
+
+    def test_send_async_exception(self):
+        executor = EmailExecutor(max_workers=1)
+        future = self.TestEmail.as_async_callable(executor=executor, to=None)()
+        with self.assertRaises(ImproperlyConfigured):
+            future.result(timeout=5)
+        executor.shutdown()
+
+    def test_send_async_timeout(self):
+        executor = EmailExecutor(max_workers=1)
+        future = executor.submit(lambda: None)
+        future.result(timeout=5)
+        blocked = threading.Event()
+        future = executor.submit(blocked.wait)
+        with self.assertRaises(SendTimeout):
+            future.result(timeout=0.01)
+        blocked.set()
+        executor.shutdown()
+
+    def test_send_many_parallel(self):
+        addresses = ['{0}@example.com'.format(i) for i in range(7)]
+        progress = []
+        results = ImportableEmail.send_many_parallel(
+            iter(addresses), processes=2, chunk_size=2, progress=progress.append,
+        )
+        self.assertEqual([message.to for message in mail.outbox],
+                         [[address] for address in addresses])
+        self.assertEqual(results, [([address], True) for address in addresses])
+        self.assertEqual(progress, [2, 4, 6, 7])
+
+    def test_send_many_parallel_filtered(self):
+        EmailClass = ImportableEmail.get_callable_class(message_filters=[not_to_b])
+        results = EmailClass.send_many_parallel(
+            ['a@example.com', 'b@example.com', 'c@example.com'], processes=2, chunk_size=2,
+            filters=[lambda message: message.to != ['c@example.com']],
+        )
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com']])
+        self.assertEqual(results, [
+            (['a@example.com'], True), (['b@example.com'], False), (['c@example.com'], False),
+        ])
+
+    def test_send_many_parallel_unordered(self):
+        addresses = ['{0}@example.com'.format(i) for i in range(7)]
+        EmailClass = ImportableEmail.get_callable_class(subject='parallel')
+        EmailClass.send_many_parallel(addresses, processes=2, chunk_size=3, ordered=False)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(addresses))
+        self.assertEqual(set(message.subject for message in mail.outbox), set(['parallel']))
+
+    def test_send_many_parallel_keeps_connections(self):
+        user = User.objects.create(username='parallel')
+        database_connection = connections['default'].connection
+        ImportableEmail.send_many_parallel(['to@example.com'], processes=2)
+        self.assertIs(connections['default'].connection, database_connection)
+        self.assertTrue(User.objects.filter(pk=user.pk).exists())
+
+    def test_send_many_parallel_instrumented(self):
+        addresses = ['{0}@example.com'.format(i) for i in range(3)]
+        with instrument() as collector:
+            ImportableEmail.send_many_parallel(addresses, processes=2, chunk_size=2)
+        self.assertEqual([message.to for message in mail.outbox], [[address] for address in addresses])
+        self.assertEqual(collector.summary()['ImportableEmail']['send']['count'], 3)
+
+    def test_instrumented_message_pickled(self):
+        with instrument() as collector:
+            message = ImportableEmail('to@example.com').get_email_message()
+            copied = pickle.loads(pickle.dumps(message))
+            copied.message()
+            message.message()
+        self.assertIsInstance(copied, EmailMessage)
+        self.assertEqual(copied.to, ['to@example.com'])
+        self.assertEqual(collector.summary()['ImportableEmail']['mime']['count'], 1)
+
+    def test_bulk_connection_fail_silently(self):
+        class TestEmail(self.TestEmail):
+            def get_fail_silently(self):
+                return True
+
+        self.assertTrue(TestEmail.get_bulk_connection().fail_silently)
+        self.assertFalse(self.TestEmail.get_bulk_connection().fail_silently)
+
+    def test_send_many_failure_continues(self):
+        addresses = ['{0}@example.com'.format(i) for i in range(3)]
+        emails = [ImportableEmail(address, fail=address == addresses[1]) for address in addresses]
+        with self.assertRaises(BulkSendError) as context:
+            ImportableEmail.send_instances(emails, batch_size=2)
+        self.assertEqual([message.to for message in mail.outbox], [[addresses[0]], [addresses[2]]])
+        self.assertEqual(
+            [(result.recipients, result.sent) for result in context.exception.results],
+            [([address], address != addresses[1]) for address in addresses],
+        )
+        self.assertIsInstance(context.exception.failed[0].error, ValueError)
+
+    @override_settings(EMAIL_BACKEND='emailtools.tests.CountingEmailBackend')
+    def test_send_many_connection_per_batch(self):
+        CountingEmailBackend.opened = 0
+        send_emails = self.TestEmail.as_bulk_callable(bulk_batch_size=2)
+        results = send_emails([()] * 5)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(CountingEmailBackend.opened, 3)
+        self.assertEqual(len(mail.outbox), 5)
+
+        class TestEmail(self.TestEmail):
+            def get_language(self):
+                return self.args[0]
+
+        CountingEmailBackend.opened = 0
+        TestEmail.send_many(['en', 'fr', 'de', 'en', 'fr'], batch_size=2)
+        self.assertEqual(CountingEmailBackend.opened, 3)
+        self.assertEqual(len(mail.outbox), 10)
+
 
 class TestHTMLEmail(TestCase):
     EMAIL_ATTRS = {
@@ -198,6 +506,92 @@ class TestHTMLEmail(TestCase):
         self.assertNotIn('<h1>', message.body)
         self.assertNotIn('<p>', message.body)
 
+    def test_recipient_context(self):
+        class TestEmail(self.TestHTMLEmail):
+            def get_context_data(self, **kwargs):
+                kwargs = super(TestEmail, self).get_context_data(**kwargs)
+                kwargs['title'] = kwargs['recipient']
+                return kwargs
+
+        TestEmail.send_to_each(['a@example.com', 'b@example.com'])
+        self.assertIn('a@example.com', mail.outbox[0].body)
+        self.assertIn('b@example.com', mail.outbox[1].body)
+
+    def test_lazy_message(self):
+        rendered = []
+
+        class TestEmail(self.TestHTMLEmail):
+            def render_template(self):
+                rendered.append(True)
+                return super(TestEmail, self).render_template()
+
+        message = TestEmail.as_lazy_callable(cc=['cc@example.com'])()
+        self.assertTrue(isinstance(message, LazyEmailMessage))
+        self.assertEqual(message.recipients(), ['to@example.com', 'cc@example.com'])
+        self.assertFalse(message.rendered)
+        self.assertEqual(rendered, [])
+        self.assertIn('test title', message.body)
+        self.assertTrue(message.rendered)
+        message.send()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(rendered, [True])
+
+    def test_lazy_message_send_kwargs(self):
+        send_kwargs = []
+
+        class TestEmail(self.TestHTMLEmail):
+            def get_send_kwargs(self, **kwargs):
+                kwargs = super(TestEmail, self).get_send_kwargs(**kwargs)
+                send_kwargs.append(kwargs)
+                return kwargs
+
+        TestEmail.as_lazy_callable(fail_silently=True)().send()
+        TestEmail.as_lazy_callable(fail_silently=True)().send(fail_silently=False)
+        self.assertEqual(send_kwargs, [{'fail_silently': True}, {'fail_silently': False}])
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_filtered_messages_not_rendered(self):
+        rendered = []
+
+        class TestEmail(self.TestHTMLEmail):
+            def __init__(self, to):
+                self.to = to
+
+            def render_template(self):
+                rendered.append(self.to)
+                return super(TestEmail, self).render_template()
+
+        results = TestEmail.send_many(
+            ['a@example.com', 'b@example.com', 'A@example.com', [], 'c@example.com'],
+            filters=[UniqueRecipients()],
+        )
+        self.assertEqual([result.sent for result in results], [True, True, False, False, True])
+        self.assertEqual(rendered, ['a@example.com', 'b@example.com', 'c@example.com'])
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(EMAIL_TEXT_CONVERTER='django.utils.html.escape')
+    def test_text_converter_setting(self):
+        self.create_and_send_a_message()
+        self.assertIn('&lt;!doctype html&gt;', mail.outbox[0].body)
+
+    def test_template_rendered_once(self):
+        rendered = []
+
+        class TestEmail(self.TestHTMLEmail):
+            def render_template(self):
+                rendered.append(True)
+                return super(TestEmail, self).render_template()
+
+        TestEmail().get_email_message()
+        self.assertEqual(len(rendered), 1)
+
+    def test_clear_rendered(self):
+        email_instance = self.TestHTMLEmail()
+        html = email_instance.get_rendered_html()
+        self.assertIs(email_instance.get_rendered_html(), html)
+        email_instance.clear_rendered()
+        self.assertIsNot(email_instance.get_rendered_html(), html)
+
 
 class TestMarkdownEmail(TestHTMLEmail):
     EMAIL_ATTRS = {
@@ -223,14 +617,1062 @@ class TestMarkdownEmail(TestHTMLEmail):
                 })
                 return kwargs
 
-        self.TestMarkdownEmail = TestMarkdownEmail
+        self.TestMarkdownEmail = self.TestHTMLEmail = TestMarkdownEmail
 
     def create_and_send_a_message(self, **kwargs):
         email_callable = self.TestMarkdownEmail.as_callable(**kwargs)
         email_callable()
 
+    def test_text_from_markdown(self):
+        self.create_and_send_a_message(text_from_markdown=True)
+        self.assertIn('#test title', mail.outbox[0].body)
+        self.assertIn('**bold**', mail.outbox[0].body)
+
+    def test_render_stages_run_once(self):
+        calls = []
+
+        class TestEmail(self.TestMarkdownEmail):
+            def render_markdown(self, md):
+                calls.append('markdown')
+                return super(TestEmail, self).render_markdown(md)
+
+            def render_layout(self, content):
+                calls.append('layout')
+                return super(TestEmail, self).render_layout(content)
+
+        message = TestEmail().get_email_message()
+        self.assertEqual(sorted(calls), ['layout', 'markdown'])
+        self.assertIn('<em>italic</em>', message.alternatives[0][0])
+        self.assertIn('<!doctype html>', message.alternatives[0][0])
+
+    def test_markdown_converter_reused(self):
+        extensions = ['markdown.extensions.extra']
+        self.assertIs(get_markdown_converter(extensions, {}),
+                      get_markdown_converter(list(extensions), {}))
+        self.assertIsNot(get_markdown_converter(extensions, {}),
+                         get_markdown_converter([], {}))
+
+    def test_markdown_html_cached(self):
+        get_markdown_cache().clear()
+        self.TestMarkdownEmail().get_email_message()
+        self.TestMarkdownEmail().get_email_message()
+        self.assertEqual(len(get_markdown_cache()), 1)
+
+    def test_markdown_extensions(self):
+        class TestEmail(self.TestMarkdownEmail):
+            markdown_extensions = []
+
+            def get_rendered_template(self):
+                return 'Term\n: Definition'
+
+        self.assertNotIn('<dl>', TestEmail().get_rendered_markdown())
+        TestEmail.markdown_extensions = ['markdown.extensions.def_list']
+        self.assertIn('<dl>', TestEmail().get_rendered_markdown())
+
+    def test_instrumentation(self):
+        with instrument() as collector:
+            self.create_and_send_a_message()
+        summary = collector.summary()['CallableTestMarkdownEmail']
+        self.assertEqual(
+            sorted(summary),
+            ['kwargs', 'layout', 'markdown', 'mime', 'send', 'template', 'text'],
+        )
+        for timings in summary.values():
+            self.assertEqual(timings['count'], 1)
+            self.assertTrue(timings['p50'] <= timings['p95'] <= timings['p99'])
+
+    def test_instrumentation_disabled(self):
+        received = []
+
+        def receiver(**kwargs):
+            received.append(kwargs)
+        email_phase_timed.connect(receiver)
+        try:
+            self.create_and_send_a_message()
+            with self.settings(EMAIL_INSTRUMENTATION=True):
+                self.create_and_send_a_message()
+        finally:
+            email_phase_timed.disconnect(receiver)
+        self.assertEqual(len(received), 7)
+
     @override_settings(EMAIL_LAYOUT=None)
     def test_missing_base_layout(self):
         self.create_and_send_a_message()
         with self.assertRaises(ImproperlyConfigured):
             self.create_and_send_a_message(layout_template=None)
+
+
+class TestHTMLToText(unittest.TestCase):
+    def test_blocks(self):
+        self.assertEqual(
+            html_to_text('<h1>Title</h1>\n  <p>One\n  two</p><p>Three<br>four</p>'),
+            'Title\n\nOne two\n\nThree\nfour',
+        )
+
+    def test_skipped_tags(self):
+        html = ('<html><head><title>Title</title><style>p { color: red; }</style></head>'
+                '<body><script>alert(1);</script><p>Body</p></body></html>')
+        self.assertEqual(html_to_text(html), 'Body')
+
+    def test_links(self):
+        self.assertEqual(
+            html_to_text('<a href="http://example.com/a">Link</a> '
+                         '<a href="http://example.com/b">http://example.com/b</a> '
+                         '<a href="#top">Top</a>'),
+            'Link (http://example.com/a) http://example.com/b Top',
+        )
+
+    def test_lists(self):
+        self.assertEqual(
+            html_to_text('<ul><li>One</li><li>Two<ol><li>A</li><li>B</li></ol></li></ul><p>After</p>'),
+            '- One\n- Two\n  1. A\n  2. B\n\nAfter',
+        )
+
+    def test_entities_and_preformatted(self):
+        self.assertEqual(
+            html_to_text('<p>A &amp; B &#169; &#x41;</p><pre>  x\n    y</pre>'),
+            u'A & B \xa9 A\n\n  x\n    y',
+        )
+
+    def test_table_cells(self):
+        self.assertEqual(
+            html_to_text('<table><tr><th>Name</th><th>Value</th></tr>\n'
+                         '<tr>\n  <td>Total</td>\n  <td></td><td><b>10</b></td>\n</tr></table>'),
+            'Name Value\n\nTotal 10',
+        )
+
+    def test_invalid_charref(self):
+        self.assertEqual(html_to_text('<p>&#99999999999999999999; &#x110000;</p>'),
+                         u'&#99999999999999999999; &#x110000;')
+
+    def test_bytestring(self):
+        self.assertEqual(html_to_text(u'<p>caf\xe9 &amp; cr\xe8me</p>'.encode('utf-8')), u'caf\xe9 & cr\xe8me')
+
+
+class TestInlineCSS(TestCase):
+    def test_inline_css(self):
+        html = inline_css(
+            '<style>p { color: red; margin: 0 } div > p.lead { color: blue } '
+            '#main b, td[align=center] { font-weight: bold !important } a:hover { color: green } '
+            '@media (max-width: 600px) { p { color: black } }</style>'
+            '<div id="main"><p class="lead" style="margin: 1px">A &amp; B</p>'
+            '<p><b style="font-weight: normal">b</b><br/></p>'
+            '<table><tr><td align="center">c</td></tr></table></div>'
+        )
+        self.assertIn('<p class="lead" style="color: blue; margin: 1px">A &amp; B</p>', html)
+        self.assertIn('<p style="color: red; margin: 0"><b style="font-weight: bold">b</b><br/></p>', html)
+        self.assertIn('<td align="center" style="font-weight: bold">c</td>', html)
+        self.assertIn('a:hover { color: green }', html)
+
+    def test_at_rule_statements(self):
+        html = inline_css(
+            '<style>@charset "utf-8"; @import url(x.css); p { color: red } '
+            '@media print { b { color: black } } i { color: blue }</style><p>a</p><b>b</b><i>c</i>'
+        )
+        self.assertIn('<p style="color: red">a</p><b>b</b><i style="color: blue">c</i>', html)
+
+    def test_selectors(self):
+        self.assertIsNone(compile_selector('a:hover'))
+        self.assertIsNone(compile_selector('p + p'))
+        self.assertEqual(compile_selector('#a .b p').specificity, (1, 1, 1))
+
+    def test_stylesheet_compiled_once(self):
+        self.assertIs(get_stylesheet('p { color: red }'), get_stylesheet('p { color: red }'))
+
+    def test_html_email_inline_css(self):
+        class TestEmail(HTMLEmail):
+            subject = 'inlined'
+            to = ['to@example.com']
+            from_email = 'from@example.com'
+            template_name = 'tests/test_inline_css.html'
+            inline_css = True
+
+        email = TestEmail()
+        message = email.get_email_message()
+        html = message.alternatives[0][0]
+        self.assertIn('<p style="color: #333; margin: 10px">', html)
+        self.assertIn('<p style="color: #333; margin: 0; font-size: 12px">Footer</p>', html)
+        self.assertEqual(message.body, html_to_text(email.get_rendered_html()))
+
+        TestEmail.inline_css = None
+        self.assertNotIn('style="color', TestEmail().get_inlined_html())
+        with self.settings(EMAIL_INLINE_CSS=True):
+            self.assertIn('style="color', TestEmail().get_inlined_html())
+
+
+class TestTemplateCache(TestCase):
+    def setUp(self):
+        clear_template_cache()
+        self.template_dir = tempfile.mkdtemp()
+        self.template_path = os.path.join(self.template_dir, 'cached.html')
+        self.write_template('first', 1000000000)
+
+    def tearDown(self):
+        shutil.rmtree(self.template_dir)
+        clear_template_cache()
+
+    def write_template(self, content, mtime):
+        with open(self.template_path, 'w') as template_file:
+            template_file.write(content)
+        os.utime(self.template_path, (mtime, mtime))
+
+    def render(self):
+        return get_template(['missing.html', 'cached.html']).render(Context())
+
+    def test_template_reused(self):
+        self.assertIs(get_template(['tests/test_HTMLEmail_template.html']),
+                      get_template(('tests/test_HTMLEmail_template.html',)))
+
+    def test_template_not_reloaded(self):
+        with self.settings(TEMPLATE_DIRS=[self.template_dir], DEBUG=False):
+            self.assertEqual(self.render(), 'first')
+            self.write_template('second', 1000000100)
+            self.assertEqual(self.render(), 'first')
+
+    def test_template_reloaded_in_debug(self):
+        with self.settings(TEMPLATE_DIRS=[self.template_dir], DEBUG=True, TEMPLATE_DEBUG=True):
+            self.assertEqual(self.render(), 'first')
+            self.write_template('second', 1000000100)
+            self.assertEqual(self.render(), 'second')
+
+
+class TestQueuedEmail(TestCase):
+    def test_enqueue_and_send(self):
+        ImportableEmail('to@example.com').enqueue()
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('send_queued_emails')
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['to@example.com'])
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_enqueue_callable_class(self):
+        EmailClass = ImportableEmail.get_callable_class(subject='overridden')
+        EmailClass('to@example.com').enqueue()
+        send_queued_emails()
+        self.assertEqual(mail.outbox[0].subject, 'overridden')
+
+    @override_settings(EMAIL_BACKEND='emailtools.tests.UnsentEmailBackend')
+    def test_unsent_retried(self):
+        queued = ImportableEmail('to@example.com').enqueue()
+        send_queued_emails()
+        queued = QueuedEmail.objects.get(pk=queued.pk)
+        self.assertEqual(queued.status, QueuedEmail.QUEUED)
+        self.assertIn('did not send', queued.last_error)
+
+    def test_grouped_by_callable_class(self):
+        PreparedEmail.prepared = []
+        PreparedEmail.get_callable_class(subject='first')('a@example.com').enqueue()
+        PreparedEmail.get_callable_class(subject='second')('b@example.com').enqueue()
+        send_queued_emails()
+        self.assertEqual(sorted(PreparedEmail.prepared), [('first', 1), ('second', 1)])
+        self.assertEqual(sorted(message.subject for message in mail.outbox), ['first', 'second'])
+
+    def test_expired_claims_fail(self):
+        queued = ImportableEmail('to@example.com').enqueue()
+        self.assertEqual(len(QueuedEmail.objects.claim(1, lease=0, max_attempts=2)), 1)
+        self.assertEqual(len(QueuedEmail.objects.claim(1, lease=0, max_attempts=2)), 1)
+        self.assertEqual(QueuedEmail.objects.claim(1, lease=0, max_attempts=2), [])
+        queued = QueuedEmail.objects.get(pk=queued.pk)
+        self.assertEqual(queued.status, QueuedEmail.FAILED)
+        self.assertEqual(queued.attempts, 2)
+
+    def test_enqueue_filtered(self):
+        EmailClass = ImportableEmail.get_callable_class(message_filters=[not_to_b])
+        EmailClass('a@example.com').enqueue()
+        EmailClass('b@example.com').enqueue()
+        send_queued_emails()
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com']])
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_enqueue_unimportable_class(self):
+        class TestEmail(ImportableEmail):
+            pass
+
+        with self.assertRaises(ImproperlyConfigured):
+            TestEmail('to@example.com').enqueue()
+
+    def test_claimed_once(self):
+        for i in range(3):
+            ImportableEmail('to@example.com').enqueue()
+        self.assertEqual(len(QueuedEmail.objects.claim(2)), 2)
+        self.assertEqual(len(QueuedEmail.objects.claim(2)), 1)
+        self.assertEqual(len(QueuedEmail.objects.claim(2)), 0)
+
+    def test_claim_expired(self):
+        ImportableEmail('to@example.com').enqueue()
+        first, = QueuedEmail.objects.claim(1, lease=0)
+        second, = QueuedEmail.objects.claim(1, lease=0)
+        self.assertFalse(first.renew())
+        self.assertTrue(second.renew())
+        first.sent()
+        first.retry('lost the claim')
+        queued = QueuedEmail.objects.get()
+        self.assertEqual(queued.status, QueuedEmail.SENDING)
+        self.assertEqual(queued.last_error, '')
+        second.sent()
+        self.assertFalse(QueuedEmail.objects.exists())
+
+    def test_supports_skip_locked(self):
+        class Connection(object):
+            features = object()
+            vendor = 'postgresql'
+            pg_version = 90406
+
+        self.assertFalse(supports_skip_locked(Connection()))
+        Connection.pg_version = 90500
+        self.assertTrue(supports_skip_locked(Connection()))
+        Connection.vendor = 'mysql'
+        self.assertFalse(supports_skip_locked(Connection()))
+
+    def test_enqueue_language(self):
+        EmailClass = ImportableEmail.get_callable_class(subject=ugettext_lazy('Yes'))
+        with translation.override('fr'):
+            EmailClass('to@example.com').enqueue()
+        EmailClass('to@example.com').enqueue()
+        send_queued_emails()
+        self.assertEqual(sorted(message.subject for message in mail.outbox), [u'Oui', u'Yes'])
+
+    def test_retry_and_fail(self):
+        queued = ImportableEmail('to@example.com', fail=True).enqueue()
+        send_queued_emails(max_attempts=2)
+        queued = QueuedEmail.objects.get(pk=queued.pk)
+        self.assertEqual(queued.status, QueuedEmail.QUEUED)
+        self.assertEqual(queued.attempts, 1)
+        self.assertIn('failed to render', queued.last_error)
+        self.assertEqual(send_queued_emails(max_attempts=2), 0)
+
+        QueuedEmail.objects.filter(pk=queued.pk).update(next_attempt=queued.created_at)
+        send_queued_emails(max_attempts=2)
+        queued = QueuedEmail.objects.get(pk=queued.pk)
+        self.assertEqual(queued.status, QueuedEmail.FAILED)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class TestUserTokenEmail(TestCase):
+    def setUp(self):
+        generated = self.generated = []
+
+        class TestEmail(UserTokenEmailMixin, BasicEmail):
+            subject = 'reset your password'
+            from_email = 'from@example.com'
+            domain = 'example.com'
+
+            def get_to(self):
+                return [self.get_user().email]
+
+            def generate_token(self, user):
+                generated.append(user.pk)
+                return super(TestEmail, self).generate_token(user)
+
+            def get_body(self):
+                return '\n'.join(self.reverse_token_url('token_view') for i in range(3))
+
+        self.TestEmail = TestEmail
+        self.users = [
+            User.objects.create(username='user{0}'.format(i), email='user{0}@example.com'.format(i))
+            for i in range(40)
+        ]
+
+    def expected_url(self, user):
+        return 'http://example.com' + reverse('token_view', kwargs={
+            'uidb36': int_to_base36(user.pk),
+            'token': UserTokenEmailMixin.token_generator.make_token(user),
+        })
+
+    def test_token_url(self):
+        for user in self.users:
+            body = self.TestEmail(user).get_body()
+            self.assertEqual(body.split('\n'), [self.expected_url(user)] * 3)
+
+    def test_token_generated_once_per_email(self):
+        self.TestEmail(self.users[0]).get_body()
+        self.assertEqual(self.generated, [self.users[0].pk])
+
+    def test_token_generated_once_per_batch(self):
+        users = [self.users[0], self.users[1], self.users[0]]
+        self.TestEmail.send_many(users)
+        self.assertEqual(sorted(self.generated), sorted([self.users[0].pk, self.users[1].pk]))
+        self.assertIn(self.expected_url(self.users[0]), mail.outbox[2].body)
+
+    @override_settings(ROOT_URLCONF='tests.i18n_urls')
+    def test_token_url_per_language(self):
+        clear_url_caches()
+        self.addCleanup(clear_url_caches)
+        urls = {}
+        for language in ('en', 'fr', 'en'):
+            with translation.override(language):
+                urls[language] = self.TestEmail(self.users[0]).reverse_token_url('token_view')
+                self.assertEqual(urls[language], self.expected_url(self.users[0]))
+        self.assertIn('/en/reset/', urls['en'])
+        self.assertIn('/fr/reset/', urls['fr'])
+
+    def test_explicit_token(self):
+        email = self.TestEmail(self.users[0])
+        self.assertEqual(
+            email.reverse_token_url('token_view', kwargs={'token': 'a-b'}),
+            'http://example.com' + reverse('token_view', kwargs={
+                'uidb36': email.get_uid(self.users[0]), 'token': 'a-b',
+            }),
+        )
+
+    def test_compile_url_template(self):
+        self.assertEqual(
+            compile_url_template('/reset/ab/1-2/', {'uid': 'ab', 'token': '1-2'}),
+            ['/reset/', 'uid', '/', 'token', '/'],
+        )
+        self.assertEqual(compile_url_template('/reset/1/1-2/', {'uid': '1', 'token': '1-2'}), None)
+
+
+class TestBulkContext(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create(username='user{0}'.format(i), email='user{0}@example.com'.format(i))
+            for i in range(5)
+        ]
+        batches = self.batches = []
+
+        class TestEmail(HTMLEmail):
+            subject = 'bulk context'
+            from_email = 'from@example.com'
+            template_name = 'tests/test_HTMLEmail_template.html'
+
+            def get_to(self):
+                return ['user{0}@example.com'.format(self.args[0])]
+
+            @classmethod
+            def get_bulk_context_data(cls, emails):
+                batches.append(len(emails))
+                users = User.objects.in_bulk([email.args[0] for email in emails])
+                return [{'title': users[email.args[0]].username} for email in emails]
+
+            def get_context_data(self, **kwargs):
+                kwargs = super(TestEmail, self).get_context_data(**kwargs)
+                kwargs.setdefault('content', 'content')
+                return kwargs
+
+        self.TestEmail = TestEmail
+
+    def test_one_query_per_batch(self):
+        pks = [user.pk for user in self.users]
+        with self.assertNumQueries(2):
+            self.TestEmail.send_many(pks, batch_size=3)
+        self.assertEqual(self.batches, [3, 2])
+        for user, message in zip(self.users, mail.outbox):
+            self.assertIn('<h1>{0}</h1>'.format(user.username), message.alternatives[0][0])
+
+    def test_single_email(self):
+        user = self.users[0]
+        self.TestEmail.as_callable()(user.pk)
+        self.assertEqual(self.batches, [1])
+        self.assertIn('<h1>{0}</h1>'.format(user.username), mail.outbox[0].alternatives[0][0])
+
+    def test_explicit_context_wins(self):
+        context = self.TestEmail(self.users[0].pk).get_context_data(title='explicit')
+        self.assertEqual(context['title'], 'explicit')
+        self.assertEqual(context['content'], 'content')
+
+
+class TestLocalization(TestCase):
+    def setUp(self):
+        class TestEmail(HTMLEmail):
+            subject = ugettext_lazy('Yes')
+            from_email = 'from@example.com'
+            template_name = 'tests/localized.html'
+
+            def get_to(self):
+                return ['{0}@example.com'.format(self.args[0])]
+
+            def get_language(self):
+                return self.args[1] if len(self.args) > 1 else None
+
+        self.TestEmail = TestEmail
+        self.activated = []
+        activate = translation.activate
+
+        def counting_activate(language):
+            self.activated.append(language)
+            return activate(language)
+        translation.activate = counting_activate
+        self.addCleanup(setattr, translation, 'activate', activate)
+
+    def test_localize_template_names(self):
+        self.assertEqual(localize_template_names('mail/welcome.html', 'pt-br'), [
+            'mail/welcome.pt-br.html', 'mail/welcome.pt.html', 'mail/welcome.html',
+        ])
+        self.assertEqual(localize_template_names(['mail/welcome.html'], None), ['mail/welcome.html'])
+
+    def test_localized_message(self):
+        language = translation.get_language()
+        message = self.TestEmail('a', 'fr').get_email_message()
+        self.assertEqual(message.subject, 'Oui')
+        self.assertIn('<p>french fr </p>', message.alternatives[0][0])
+        self.assertEqual(translation.get_language(), language)
+
+    def test_fallback_template(self):
+        message = self.TestEmail('a', 'de').get_email_message()
+        self.assertIn('<p>default de </p>', message.alternatives[0][0])
+
+    def test_default_language(self):
+        message = self.TestEmail('a').get_email_message()
+        self.assertEqual(message.subject, 'Yes')
+        self.assertEqual(self.activated, [])
+
+    def test_bulk_grouped_by_language(self):
+        items = [('a', 'fr'), ('b', 'de'), ('c', 'fr'), ('d', None), ('e', 'de')]
+        results = self.TestEmail.send_many(items, batch_size=5)
+        self.assertEqual([result.recipients for result in results], [
+            ['{0}@example.com'.format(name)] for name, language in items
+        ])
+        self.assertEqual([language for language in self.activated if language in ('fr', 'de')], ['fr', 'de'])
+        subjects = dict((message.to[0], message.subject) for message in mail.outbox)
+        self.assertEqual(subjects['c@example.com'], 'Oui')
+        self.assertEqual(subjects['d@example.com'], 'Yes')
+
+
+class TestBuildAbsoluteURI(TestCase):
+    def setUp(self):
+        clear_site_domain_cache()
+        Site.objects.clear_cache()
+
+    def test_site_domain_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(BuildAbsoluteURIMixin().get_domain(), 'example.com')
+        Site.objects.clear_cache()
+        with self.assertNumQueries(0):
+            email = BuildAbsoluteURIMixin()
+            self.assertEqual(email.build_absolute_uri('/a/'), 'http://example.com/a/')
+            self.assertEqual(email.build_absolute_uri('/b/'), 'http://example.com/b/')
+
+    def test_site_domain_invalidated(self):
+        BuildAbsoluteURIMixin().get_domain()
+        Site.objects.filter(pk=1).update(domain='changed.example.com')
+        self.assertEqual(BuildAbsoluteURIMixin().get_domain(), 'example.com')
+        site = Site.objects.get(pk=1)
+        site.save()
+        self.assertEqual(BuildAbsoluteURIMixin().get_domain(), 'changed.example.com')
+
+    @override_settings(EMAIL_SITE_DOMAIN='setting.example.com')
+    def test_site_domain_setting(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(BuildAbsoluteURIMixin().get_domain(), 'setting.example.com')
+
+
+@override_settings(EMAIL_SUPPRESSION_STORE='emailtools.suppression.DatabaseSuppressionStore')
+class TestSuppression(TestCase):
+    def setUp(self):
+        reload_suppression_stores()
+        SuppressedAddress.objects.create(address='Suppressed@example.com')
+
+        class TestEmail(BasicEmail):
+            subject = 'newsletter'
+            from_email = 'from@example.com'
+            body = 'newsletter body'
+            suppress_recipients = True
+
+        self.TestEmail = TestEmail
+
+    def test_index(self):
+        addresses = ['user{0}@example.com'.format(i) for i in range(1000)]
+        index = SuppressionIndex(address_hash(address) for address in addresses[:500])
+        index.add(address_hash(address) for address in addresses[400:600])
+        self.assertEqual(len(index), 600)
+        self.assertTrue(all(address_hash(address) in index for address in addresses[:600]))
+        self.assertFalse(any(address_hash(address) in index for address in addresses[600:]))
+        self.assertIn(address_hash('User 1 <USER1@example.com>'), index)
+
+    def test_recipients_filtered(self):
+        EmailClass = self.TestEmail.get_callable_class(
+            to=['to@example.com', 'suppressed@example.com'],
+            cc=['suppressed@example.com'],
+        )
+        EmailClass().send()
+        self.assertEqual(mail.outbox[0].to, ['to@example.com'])
+        self.assertEqual(mail.outbox[0].cc, [])
+
+    def test_not_suppressed_by_default(self):
+        class TestEmail(self.TestEmail):
+            to = ['suppressed@example.com']
+            suppress_recipients = False
+
+        TestEmail().send()
+        self.assertEqual(mail.outbox[0].to, ['suppressed@example.com'])
+
+    def test_bulk_send_filtered_in_memory(self):
+        self.TestEmail.send_to_each(['to@example.com'])
+        recipients = ['user{0}@example.com'.format(i) for i in range(50)] + ['suppressed@example.com']
+        with self.assertNumQueries(0):
+            sent = self.TestEmail.send_to_each(recipients)
+        self.assertEqual(sent, 50)
+        self.assertNotIn(['suppressed@example.com'], [message.to for message in mail.outbox])
+
+    def test_incremental_refresh(self):
+        store = DatabaseSuppressionStore(refresh_interval=0)
+        self.assertEqual(store.filter(['new@example.com']), ['new@example.com'])
+        index = store.get_index()
+        SuppressedAddress.objects.create(address='new@example.com')
+        self.assertEqual(store.filter(['new@example.com']), [])
+        self.assertIs(store.get_index(), index)
+
+    def test_periodic_reload(self):
+        # Stores of other processes aren't reloaded by the delete signal.
+        stale = DatabaseSuppressionStore(refresh_interval=0)
+        store = DatabaseSuppressionStore(refresh_interval=0, reload_interval=0)
+        self.assertEqual(stale.filter(['suppressed@example.com']), [])
+        self.assertEqual(store.filter(['suppressed@example.com']), [])
+        SuppressedAddress.objects.get(address='suppressed@example.com').delete()
+        self.assertEqual(stale.filter(['suppressed@example.com']), [])
+        self.assertEqual(store.filter(['suppressed@example.com']), ['suppressed@example.com'])
+
+    def test_hash_width(self):
+        self.assertGreaterEqual(array(HASH_TYPECODE).itemsize, 8 if sys.maxsize > 2 ** 32 else 4)
+        self.assertLess(address_hash('user@example.com'), 1 << (8 * array(HASH_TYPECODE).itemsize))
+
+    @override_settings(EMAIL_SUPPRESSION_STORE=None)
+    def test_store_not_configured(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.TestEmail.send_to_each(['to@example.com'])
+        self.assertEqual(mail.outbox, [])
+
+    def test_reloaded_on_delete(self):
+        store = get_suppression_store()
+        self.assertEqual(store.filter(['suppressed@example.com']), [])
+        SuppressedAddress.objects.get(address='suppressed@example.com').delete()
+        self.assertEqual(store.filter(['suppressed@example.com']), ['suppressed@example.com'])
+
+    def test_file_store(self):
+        handle, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w') as f:
+            f.write('first@example.com\n')
+        store = FileSuppressionStore(path, refresh_interval=0)
+        self.assertEqual(store.filter(['first@example.com', 'second@example.com']), ['second@example.com'])
+        with open(path, 'a') as f:
+            f.write('second@example.com\nthird@exa')
+        self.assertEqual(store.filter(['second@example.com', 'third@example.com']), ['third@example.com'])
+        with open(path, 'a') as f:
+            f.write('mple.com\n')
+        self.assertEqual(store.filter(['third@example.com']), [])
+        with open(path, 'w') as f:
+            f.write('second@example.com\n')
+        self.assertEqual(store.filter(['first@example.com']), ['first@example.com'])
+
+
+class TestThrottle(TestCase):
+    def setUp(self):
+        self.slept = slept = []
+        self.throttle = Throttle(
+            rates={'emailtools.tests.FlakyEmailBackend': 1000},
+            domain_rates={'slow.example.com': 1},
+            sleep=slept.append,
+        )
+        throttle = self.throttle
+
+        class TestEmail(BasicEmail):
+            subject = 'throttled'
+            from_email = 'from@example.com'
+            body = 'throttled body'
+
+            @classmethod
+            def get_throttle(cls):
+                return throttle
+
+        self.TestEmail = TestEmail
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(10, burst=2)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1, places=2)
+        bucket.decrease()
+        self.assertEqual(bucket.rate, 5)
+        bucket.increase()
+        self.assertEqual(bucket.rate, 5.1)
+
+    def test_transient_error(self):
+        self.assertTrue(is_transient_error(smtplib.SMTPDataError(451, 'try again later')))
+        self.assertFalse(is_transient_error(smtplib.SMTPDataError(554, 'rejected')))
+        self.assertTrue(is_transient_error(smtplib.SMTPRecipientsRefused({'to@example.com': (450, 'busy')})))
+        self.assertFalse(is_transient_error(ValueError()))
+
+    def test_domain_rate_limited(self):
+        EmailClass = self.TestEmail.get_callable_class(connection=FlakyEmailBackend())
+        EmailClass.send_to_each(['a@slow.example.com', 'b@fast.example.com', 'c@slow.example.com'])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(len(self.slept), 1)
+        self.assertAlmostEqual(self.slept[0], 1, places=1)
+
+    def test_backoff_and_retry(self):
+        connection = FlakyEmailBackend(failures=2, error=smtplib.SMTPDataError(451, 'slow down'))
+        EmailClass = self.TestEmail.get_callable_class(connection=connection)
+        EmailClass.send_to_each(['to@example.com'])
+        self.assertEqual(len(mail.outbox), 1)
+        bucket = self.throttle.buckets[('backend', 'emailtools.tests.FlakyEmailBackend')]
+        self.assertEqual(bucket.rate, 250 + 10)
+        self.assertEqual(len(self.slept), 2)
+        self.assertAlmostEqual(self.slept[0], 1 / 500.0, places=3)
+        self.assertTrue(self.slept[1] > self.slept[0])
+
+    def test_invalid_rate(self):
+        with self.assertRaises(ImproperlyConfigured):
+            Throttle(domain_rates={'example.com': 0})
+        with self.assertRaises(ValueError):
+            TokenBucket(-1)
+
+    def test_permanent_error_not_retried(self):
+        connection = FlakyEmailBackend(failures=1, error=smtplib.SMTPDataError(554, 'rejected'))
+        EmailClass = self.TestEmail.get_callable_class(connection=connection)
+        with self.assertRaises(BulkSendError) as context:
+            EmailClass.send_to_each(['to@example.com', 'other@example.com'])
+        self.assertEqual(len(mail.outbox), 1)
+        failed, = context.exception.failed
+        self.assertEqual(failed.recipients, ['to@example.com'])
+        self.assertIsInstance(failed.error, smtplib.SMTPDataError)
+
+    def test_queued_emails_throttled(self):
+        with self.settings(EMAIL_DOMAIN_RATE_LIMITS={'*': 1}):
+            throttle = get_default_throttle()
+            throttle.sleep = self.slept.append
+            ImportableEmail('to@example.com').enqueue()
+            ImportableEmail('to@example.com').enqueue()
+            send_queued_emails()
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(len(self.slept), 1)
+
+    def test_not_configured(self):
+        self.assertIs(get_default_throttle(), None)
+
+
+class CountingSMTPServer(smtpd.SMTPServer):
+    def __init__(self, *args, **kwargs):
+        smtpd.SMTPServer.__init__(self, *args, **kwargs)
+        self.accepted = 0
+        self.messages = []
+
+    def handle_accept(self):
+        self.accepted += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append(rcpttos)
+
+
+class TestPooledEmailBackend(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestPooledEmailBackend, cls).setUpClass()
+        # A single loop serves every test, as concurrent loops over the
+        # shared asyncore map would race each other.
+        cls.server = CountingSMTPServer(('127.0.0.1', 0), None)
+        thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.01})
+        thread.daemon = True
+        thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.close()
+        super(TestPooledEmailBackend, cls).tearDownClass()
+
+    def setUp(self):
+        self.server.accepted = 0
+        self.server.messages = []
+        self.pool = get_connection_pool()
+        self.addCleanup(self.pool.clear)
+        host, port = self.server.socket.getsockname()
+
+        class TestEmail(BasicEmail):
+            subject = 'pooled'
+            from_email = 'from@example.com'
+            to = ['to@example.com']
+            body = 'pooled body'
+
+            def get_connection(self):
+                return PooledEmailBackend(host=host, port=port, username='', password='', use_tls=False)
+
+        self.TestEmail = TestEmail
+
+    def test_connection_reused(self):
+        for i in range(3):
+            self.TestEmail().send()
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(self.server.accepted, 1)
+
+    def test_idle_connection_closed(self):
+        self.TestEmail().send()
+        idle_timeout, self.pool.idle_timeout = self.pool.idle_timeout, -1
+        try:
+            self.TestEmail().send()
+        finally:
+            self.pool.idle_timeout = idle_timeout
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.server.accepted, 2)
+
+    def test_unhealthy_connection_replaced(self):
+        self.TestEmail().send()
+        for idle in self.pool.idle.values():
+            for connection, released_at in idle:
+                connection.sock.close()
+        self.TestEmail().send()
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.server.accepted, 2)
+
+    def test_reconnect_on_disconnect(self):
+        self.TestEmail().send()
+        for idle in self.pool.idle.values():
+            for connection, released_at in idle:
+                def sendmail(*args, **kwargs):
+                    raise smtplib.SMTPServerDisconnected()
+                connection.sendmail = sendmail
+        self.TestEmail().send()
+        self.assertEqual(len(self.server.messages), 2)
+        self.assertEqual(self.server.accepted, 2)
+
+    def test_connection_pool_setting(self):
+        with self.settings(EMAIL_CONNECTION_POOL=True):
+            self.assertIsInstance(ImportableEmail('to@example.com').get_connection(), PooledEmailBackend)
+            self.assertIsInstance(ImportableEmail.get_bulk_connection(), PooledEmailBackend)
+        self.assertIs(ImportableEmail('to@example.com').get_connection(), None)
+
+
+class TestFragmentCache(TestCase):
+    def setUp(self):
+        clear_fragment_cache()
+        self.addCleanup(clear_fragment_cache)
+
+        class TestEmail(MarkdownEmail):
+            subject = 'fragments'
+            to = ['to@example.com']
+            from_email = 'from@example.com'
+            template_name = 'tests/test_MarkdownEmail_template.md'
+            layout_template = 'mail/fragment_layout.html'
+
+            def get_layout_context_data(self, **kwargs):
+                kwargs = super(TestEmail, self).get_layout_context_data(**kwargs)
+                kwargs.update(self.kwargs)
+                return kwargs
+
+        self.TestEmail = TestEmail
+
+    def render(self, email_class=None, **kwargs):
+        return (email_class or self.TestEmail)(**kwargs).get_rendered_html()
+
+    def test_fragment_reused(self):
+        self.assertIn('<h1>first</h1>', self.render(header='first', footer='first'))
+        html = self.render(header='second', footer='second')
+        self.assertIn('<h1>first</h1>', html)
+        self.assertIn('<p>first</p>', html)
+
+    def test_fragment_varies(self):
+        self.render(header='first', footer='first')
+        self.assertIn('<p>second</p>', self.render(footer='second', footer_variant='b'))
+
+        EmailClass = self.TestEmail.get_callable_class(subject='other')
+        self.assertIn('<h1>other class</h1>', self.render(EmailClass, header='other class'))
+
+        translation.activate('de')
+        try:
+            self.assertIn('<h1>german</h1>', self.render(header='german'))
+        finally:
+            translation.deactivate()
+
+    def test_django_cache_backend(self):
+        with self.settings(EMAIL_FRAGMENT_CACHE='default'):
+            clear_fragment_cache()
+            self.assertNotIsInstance(get_fragment_cache(), LRUCache)
+            self.render(header='first')
+            self.assertIn('<h1>first</h1>', self.render(header='second'))
+        clear_fragment_cache()
+
+
+class TestAttachments(TestCase):
+    def setUp(self):
+        clear_attachment_cache()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'invoice.pdf')
+        self.content = os.urandom(200000)
+        with open(self.path, 'wb') as f:
+            f.write(self.content)
+
+        class TestEmail(BasicEmail):
+            subject = 'attachments'
+            to = ['to@example.com']
+            from_email = 'from@example.com'
+            body = 'attachments body'
+
+        self.TestEmail = TestEmail
+
+    def get_attachments(self, message):
+        parsed = message_from_string(message.message().as_string())
+        return [
+            (part.get_filename(), part.get_content_type(), part.get_payload(decode=True))
+            for part in parsed.walk() if part.get_filename()
+        ]
+
+    def test_path(self):
+        EmailClass = self.TestEmail.get_callable_class(attachments=[self.path])
+        attachments = self.get_attachments(EmailClass().get_email_message())
+        self.assertEqual(attachments, [('invoice.pdf', 'application/pdf', self.content)])
+
+    def test_file_like(self):
+        source = BytesIO(b'a,b\n1,2\n')
+        EmailClass = self.TestEmail.get_callable_class(
+            attachments=[Attachment(source, filename='report.csv'), ('note.txt', 'note', 'text/plain')],
+        )
+        for i in range(2):
+            attachments = self.get_attachments(EmailClass().get_email_message())
+            self.assertEqual(attachments, [
+                ('report.csv', 'text/csv', b'a,b\n1,2\n'),
+                ('note.txt', 'text/plain', b'note'),
+            ])
+
+    def test_encoded_once(self):
+        EmailClass = self.TestEmail.get_callable_class(attachments=[self.path])
+        first = EmailClass().get_attachments()[0]
+        self.assertIs(EmailClass().get_attachments()[0], first)
+        with open(self.path, 'rb') as source:
+            self.assertIs(self.TestEmail.get_callable_class(attachments=[source])().get_attachments()[0], first)
+        self.assertEqual(len(get_attachment_cache()), 1)
+
+    def test_modified_path(self):
+        EmailClass = self.TestEmail.get_callable_class(attachments=[self.path])
+        first = EmailClass().get_attachments()[0]
+        with open(self.path, 'wb') as f:
+            f.write(b'changed')
+        os.utime(self.path, (0, 0))
+        self.assertIsNot(EmailClass().get_attachments()[0], first)
+        attachments = self.get_attachments(EmailClass().get_email_message())
+        self.assertEqual(attachments, [('invoice.pdf', 'application/pdf', b'changed')])
+
+
+class TestMIMECache(TestCase):
+    def setUp(self):
+        clear_mime_cache()
+
+        class TestEmail(HTMLEmail):
+            cache_mime = True
+            subject = u'Caf\xe9 news'
+            from_email = 'from@example.com'
+            template_name = 'tests/test_HTMLEmail_template.html'
+            attachments = [('note.txt', 'note', 'text/plain')]
+
+            def get_context_data(self, **kwargs):
+                kwargs = super(TestEmail, self).get_context_data(**kwargs)
+                kwargs.update({
+                    'title': 'test title',
+                    'content': 'test content',
+                })
+                return kwargs
+
+        self.TestEmail = TestEmail
+
+    def get_message(self, to, **kwargs):
+        return self.TestEmail.get_callable_class(to=[to], **kwargs)().get_email_message().message()
+
+    def test_identical_content_reused(self):
+        first = self.get_message('first@example.com')
+        second = self.get_message('second@example.com')
+        self.assertEqual(len(get_mime_cache()), 1)
+        self.assertEqual(first['To'], 'first@example.com')
+        self.assertEqual(second['To'], 'second@example.com')
+        self.assertNotEqual(first['Message-ID'], second['Message-ID'])
+        self.assertIs(first.get_payload()[0], second.get_payload()[0])
+
+    def test_serialization(self):
+        self.get_message('first@example.com')
+        message = self.get_message('second@example.com')
+        self.assertEqual(message.as_string(), message.__class__.as_string(message))
+        parsed = message_from_string(message.as_string())
+        self.assertEqual(parsed['To'], 'second@example.com')
+        self.assertEqual(
+            [part.get_content_type() for part in parsed.walk()],
+            ['multipart/mixed', 'multipart/alternative', 'text/plain', 'text/html', 'text/plain'],
+        )
+
+    def test_different_content(self):
+        self.get_message('first@example.com')
+        message = self.get_message('second@example.com', subject='Other news')
+        self.assertEqual(len(get_mime_cache()), 2)
+        self.assertEqual(message['Subject'], 'Other news')
+
+    def test_overridden_headers(self):
+        message = self.get_message('first@example.com', headers={'Message-ID': '<fixed@example.com>'})
+        self.assertEqual(message['Message-ID'], '<fixed@example.com>')
+
+    def test_as_string_arguments(self):
+        self.get_message('first@example.com')
+        message = self.get_message('second@example.com')
+        self.assertEqual(message.as_string(linesep='\n'), message.__class__.as_string(message))
+        self.assertTrue(message.as_string(unixfrom=True).startswith('From '))
+
+    def test_pickled(self):
+        message = self.TestEmail.get_callable_class(to=['first@example.com'])().get_email_message()
+        copied = pickle.loads(pickle.dumps(message))
+        self.assertEqual(copied.__class__, message.__class__)
+        self.assertEqual(copied.message()['To'], 'first@example.com')
+
+    @override_settings(EMAIL_MIME_CACHE=True)
+    def test_send_many_parallel(self):
+        addresses = ['{0}@example.com'.format(i) for i in range(3)]
+        ImportableEmail.send_many_parallel(addresses, processes=2, chunk_size=2)
+        self.assertEqual([message.to for message in mail.outbox], [[address] for address in addresses])
+
+    def test_disabled(self):
+        self.TestEmail.cache_mime = False
+        self.get_message('first@example.com')
+        self.assertEqual(len(get_mime_cache()), 0)
+
+    def test_sent(self):
+        self.TestEmail.as_callable(to=['first@example.com'])()
+        self.TestEmail.as_callable(to=['second@example.com'])()
+        self.assertEqual([message.to for message in mail.outbox], [['first@example.com'], ['second@example.com']])
+        self.assertEqual(mail.outbox[1].message()['To'], 'second@example.com')
+
+
+class TestRenderMany(TestCase):
+    def setUp(self):
+        class TestEmail(HTMLEmail):
+            subject = 'render many'
+            from_email = 'from@example.com'
+            template_name = 'tests/test_HTMLEmail_template.html'
+
+            def get_to(self):
+                return [self.args[0]]
+
+        self.TestEmail = TestEmail
+
+    def test_render_many(self):
+        items = ['user{0}@example.com'.format(i) for i in range(10)]
+        report = self.TestEmail.render_many(items, batch_size=4, sample=2)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(report.count, 10)
+        self.assertEqual([message.to for message in report.samples], [[items[0]], [items[1]]])
+        self.assertAlmostEqual(report.bytes_per_message, len(report.samples[0].message().as_string()), delta=10)
+        self.assertTrue(report.messages_per_second > 0)
+        self.assertEqual(report.phases['template']['count'], 10)
+        self.assertEqual(report.phases['mime']['count'], 10)
+        self.assertNotIn('send', report.phases)
+        self.assertIn('memory', report.phases['kwargs'])
+
+    def test_command(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        args_file = os.path.join(directory, 'args.json')
+        with open(args_file, 'w') as f:
+            f.write('["a@example.com"]\n["b@example.com"]\n')
+        stdout = StringIO()
+        call_command(
+            'render_emails', 'emailtools.tests.ImportableEmail', args_file=args_file, count=5,
+            sample_dir=directory, samples=1, json=True, stdout=stdout,
+        )
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report['count'], 5)
+        self.assertEqual(report['email_class'], 'ImportableEmail')
+        self.assertEqual(len(mail.outbox), 0)
+        with open(os.path.join(directory, 'message-0.eml')) as f:
+            self.assertEqual(message_from_string(f.read())['To'], 'a@example.com')
+
+    def test_command_text_report(self):
+        stdout = StringIO()
+        attrs = {'to': ['a@example.com'], 'subject': 'generated', 'body': 'generated body'}
+        call_command('render_emails', 'emailtools.BasicEmail', attrs=json.dumps(attrs), count=3, stdout=stdout)
+        self.assertIn('3 messages in', stdout.getvalue())
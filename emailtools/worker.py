@@ -0,0 +1,71 @@
+import traceback
+
+from django.conf import settings
+
+from .cbe.base import send_message
+from .cbe.localization import group_by_language, language_activated
+from .cbe.utils import OrderedDict
+from .models import QueuedEmail
+
+
+def send_queued_emails(batch_size=None, max_attempts=None, retry_delay=None):
+    """
+    Claims a batch of queued emails, then renders and sends them over one
+    connection per email class.  Emails which fail are retried later.  Returns
+    the number of emails claimed.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, 'EMAIL_QUEUE_BATCH_SIZE', 100)
+    queued_emails = QueuedEmail.objects.claim(batch_size, max_attempts=max_attempts)
+
+    # Grouped by the loaded class rather than its path, as the callable
+    # classes of one path may set a different connection or bulk context.
+    groups = OrderedDict()
+    for queued in queued_emails:
+        try:
+            email = queued.get_email()
+        except Exception:
+            queued.retry(traceback.format_exc(), max_attempts, retry_delay)
+        else:
+            groups.setdefault(email.__class__, []).append((queued, email))
+
+    for email_class, group in groups.items():
+        try:
+            email_class.prepare_batch([email for queued, email in group])
+            connection = email_class.get_bulk_connection()
+            opened = connection.open()
+        except Exception:
+            error = traceback.format_exc()
+            for queued, email in group:
+                queued.retry(error, max_attempts, retry_delay)
+            continue
+        queued_by_email = dict((id(email), queued) for queued, email in group)
+        try:
+            for language, language_emails in group_by_language([email for queued, email in group]):
+                with language_activated(language):
+                    for email in language_emails:
+                        queued = queued_by_email[id(email)]
+                        # Skip emails claimed again by another worker after
+                        # their lease expired.
+                        if not queued.renew():
+                            continue
+                        try:
+                            # Emails without a language of their own are built
+                            # in the one active when they were enqueued.
+                            with language_activated(language or queued.get_language()):
+                                message = email.get_email_message()
+                            # Emails dropped by the message filters are done
+                            # with, as sent ones are.
+                            if email_class.filter_message(message):
+                                # Backends which fail silently report a
+                                # failure by not counting the message as sent.
+                                if not send_message(connection, message, email_class):
+                                    raise RuntimeError('The backend did not send the message.')
+                        except Exception:
+                            queued.retry(traceback.format_exc(), max_attempts, retry_delay)
+                        else:
+                            queued.sent()
+        finally:
+            if opened:
+                connection.close()
+    return len(queued_emails)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the hot paths of emailtools.
+
+Run all benchmarks and write the results as JSON::
+
+    $ ./benchmarks.py --output results.json
+
+Compare a new run against earlier results, exiting with a non-zero status if
+any benchmark is slower by more than the threshold::
+
+    $ ./benchmarks.py --compare results.json --threshold 0.1
+"""
+from __future__ import print_function
+
+import asyncore
+import datetime
+import json
+import os
+import platform
+import shutil
+import smtpd
+import sys
+import tempfile
+import threading
+import timeit
+from itertools import count
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.sqlite_test_settings')
+
+import django
+from django.conf import settings
+from django.core import mail
+
+BENCHMARKS = []
+CLEANUPS = []
+
+
+def benchmark(func):
+    """
+    Registers a benchmark.  The decorated function does any setup and
+    returns the callable to be timed.
+    """
+    BENCHMARKS.append(func)
+    return func
+
+
+def add_cleanup(func):
+    """
+    Registers a function to be called once the current benchmark has run.
+    """
+    CLEANUPS.append(func)
+
+
+def make_templates(directory):
+    paragraph = 'Lorem ipsum dolor sit amet, {{ user }} consectetur adipiscing elit.'
+    for name, paragraphs in (('small', 5), ('large', 500)):
+        with open(os.path.join(directory, 'bench_{0}.html'.format(name)), 'w') as f:
+            f.write('<div>\n' + '\n'.join('<p>{0}</p>'.format(paragraph) for i in range(paragraphs)) + '\n</div>')
+        with open(os.path.join(directory, 'bench_{0}.md'.format(name)), 'w') as f:
+            f.write('\n\n'.join('- *{0}*'.format(paragraph) for i in range(paragraphs)))
+
+
+class DummySMTPServer(smtpd.SMTPServer):
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        return None
+
+
+def start_smtp_server():
+    server = DummySMTPServer(('127.0.0.1', 0), None)
+    thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+    thread.daemon = True
+    thread.start()
+
+    def stop():
+        # Closing the server and its channels ends the loop.
+        asyncore.close_all()
+        thread.join()
+    add_cleanup(stop)
+    return server.socket.getsockname()
+
+
+def define_benchmarks():
+    from django.contrib.auth.models import User
+    from django.core.mail.backends.smtp import EmailBackend as SMTPBackend
+
+    from emailtools import BasicEmail, HTMLEmail, MarkdownEmail
+    from emailtools.cbe.mixins import UserTokenEmailMixin
+
+    class BenchBasicEmail(BasicEmail):
+        subject = 'Benchmark'
+        to = ['to@example.com']
+        from_email = 'from@example.com'
+        body = 'Benchmark body'
+
+    class BenchHTMLEmail(HTMLEmail):
+        subject = 'Benchmark'
+        to = ['to@example.com']
+        from_email = 'from@example.com'
+
+        def get_context_data(self, **kwargs):
+            kwargs['user'] = 'benchmark user'
+            return kwargs
+
+    class BenchMarkdownEmail(MarkdownEmail, BenchHTMLEmail):
+        layout_template = 'mail/base.html'
+        # Each message has its own content, so the markdown is converted
+        # every time rather than read from the cache.
+        counter = count()
+
+        def get_context_data(self, **kwargs):
+            kwargs = super(BenchMarkdownEmail, self).get_context_data(**kwargs)
+            kwargs['user'] = 'benchmark user {0}'.format(next(self.counter))
+            return kwargs
+
+    class BenchTokenEmail(UserTokenEmailMixin, BenchBasicEmail):
+        domain = 'example.com'
+
+        def get_body(self):
+            return '\n'.join(
+                self.reverse_token_url('token_view') for i in range(10)
+            )
+
+    for name in ('small', 'large'):
+        for email_class, extension in ((BenchHTMLEmail, 'html'), (BenchMarkdownEmail, 'md')):
+            def build(email_class=email_class, template_name='bench_{0}.{1}'.format(name, extension)):
+                EmailClass = email_class.get_callable_class(template_name=template_name)
+                return lambda: EmailClass().get_email_message().message()
+            build.__name__ = '{0}_{1}'.format(email_class.__name__[5:].lower(), name)
+            benchmark(build)
+
+    @benchmark
+    def basic_message():
+        return lambda: BenchBasicEmail().get_email_message().message()
+
+    @benchmark
+    def basic_send_locmem():
+        return lambda: BenchBasicEmail().send()
+
+    @benchmark
+    def as_callable_create():
+        return lambda: BenchBasicEmail.as_callable(subject='Overridden')
+
+    @benchmark
+    def as_callable_send_locmem():
+        return BenchBasicEmail.as_callable(subject='Overridden')
+
+    @benchmark
+    def user_token_urls():
+        user = User(pk=1, username='benchmark', password='!', last_login=datetime.datetime(2013, 1, 1))
+        return lambda: BenchTokenEmail(user).get_body()
+
+    @benchmark
+    def basic_send_smtp():
+        host, port = start_smtp_server()
+        EmailClass = BenchBasicEmail.get_callable_class(connection=SMTPBackend(host=host, port=port))
+        return lambda: EmailClass().send()
+
+    @benchmark
+    def basic_send_many_smtp():
+        host, port = start_smtp_server()
+        EmailClass = BenchBasicEmail.get_callable_class(connection=SMTPBackend(host=host, port=port))
+        return lambda: EmailClass.send_many([()] * 10)
+
+
+def run_benchmarks(names=None, number=100, repeat=5):
+    results = {}
+    for func in BENCHMARKS:
+        if names and func.__name__ not in names:
+            continue
+        operation = func()
+        try:
+            operation()  # Warm up any caches.
+            mail.outbox = []
+            timings = sorted(
+                duration / number
+                for duration in timeit.repeat(operation, number=number, repeat=repeat)
+            )
+            mail.outbox = []
+        finally:
+            while CLEANUPS:
+                CLEANUPS.pop()()
+        results[func.__name__] = {
+            'min': timings[0],
+            'median': timings[len(timings) // 2],
+            'ops_per_sec': 1 / timings[0],
+        }
+        print('{0:<28} {1:>12.1f} us'.format(func.__name__, timings[0] * 1e6), file=sys.stderr)
+    return results
+
+
+def compare_results(results, baseline, threshold):
+    """
+    Returns `(name, baseline, current, change)` for each benchmark that is
+    slower than in `baseline` by more than `threshold`.
+    """
+    regressions = []
+    for name, current in sorted(results.items()):
+        if name not in baseline:
+            continue
+        previous = baseline[name]['min']
+        change = (current['min'] - previous) / previous
+        if change > threshold:
+            regressions.append((name, previous, current['min'], change))
+    return regressions
+
+
+def main():
+    parser = OptionParser(usage='%prog [options] [benchmark ...]')
+    parser.add_option('--output', help='Write the results as JSON to this file.')
+    parser.add_option('--compare', help='Compare against the results in this JSON file.')
+    parser.add_option('--threshold', type='float', default=0.1,
+                      help='Relative slowdown reported as a regression.')
+    parser.add_option('--number', type='int', default=100,
+                      help='Operations per timing.')
+    parser.add_option('--repeat', type='int', default=5,
+                      help='Timings per benchmark.')
+    options, names = parser.parse_args()
+
+    template_dir = tempfile.mkdtemp()
+    make_templates(template_dir)
+    settings.TEMPLATE_DIRS = tuple(settings.TEMPLATE_DIRS) + (template_dir,)
+    settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+    settings.DEBUG = False
+    if hasattr(django, 'setup'):
+        django.setup()
+
+    try:
+        define_benchmarks()
+        results = run_benchmarks(names, options.number, options.repeat)
+    finally:
+        shutil.rmtree(template_dir)
+
+    output = json.dumps({
+        'meta': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'number': options.number,
+            'repeat': options.repeat,
+        },
+        'results': results,
+    }, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare_results(results, baseline, options.threshold)
+        for name, previous, current, change in regressions:
+            print('REGRESSION {0}: {1:.1f} us -> {2:.1f} us ({3:+.0%})'.format(
+                name, previous * 1e6, current * 1e6, change), file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+from django.conf.urls import url
+from django.conf.urls.i18n import i18n_patterns
+
+from .urls import token_view
+
+
+urlpatterns = i18n_patterns('',
+    url(r'^reset/(?P<uidb36>[0-9A-Za-z]+)/(?P<token>[0-9A-Za-z]+-[0-9A-Za-z]+)/$',
+        token_view, name='token_view'),
+)
@@ -9,6 +9,7 @@ INSTALLED_APPS = (
     'django.contrib.sessions',
     'django.contrib.contenttypes',
     'django.contrib.auth',
+    'django.contrib.sites',
     'django.contrib.admin',
     'django.contrib.staticfiles',
     'tests',
@@ -24,5 +25,7 @@ DATABASES = {
 
 ROOT_URLCONF = 'tests.urls'
 
+SITE_ID = 1
+
 STATIC_URL = '/static/'
 DEBUG = True
@@ -1,5 +1,12 @@
 from django.conf.urls import patterns, include, url
+from django.http import HttpResponse
+
+
+def token_view(request, uidb36, token):
+    return HttpResponse()
 
 
 urlpatterns = patterns('',
+    url(r'^reset/(?P<uidb36>[0-9A-Za-z]+)/(?P<token>[0-9A-Za-z]+-[0-9A-Za-z]+)/$',
+        token_view, name='token_view'),
 )